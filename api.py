@@ -0,0 +1,134 @@
+"""JSON query API over the leading causes of death table.
+
+  GET /api/v1/deaths?age=D&race=*&cod=Homicide&state=48
+
+Parameters, all optional:
+  age, race, cod  a value, comma separated values, or * (the default).
+                  Every combination of the listed values is a series of its
+                  own; a * dimension is aggregated over, e.g. race=* gives
+                  one series per age and cause over all races.
+  state           two digit state FIPS codes, comma separated
+  fips            five digit county FIPS codes, comma separated
+  agg             how a series combines its columns per county: mean (the
+                  default), sum, min, max or count of valid values
+
+The answer is columnar, one list per field, counties in table order:
+  {"fips": [...], "county": [...], "state": [...],
+   "series": {"D_*_Homicide": [...]},
+   "columns": {"D_*_Homicide": ["D_Wh_Homicide", ...]}}
+Invalid values (see DEFINEDDATAVALUE.csv) are left out of the aggregates
+and null where nothing is left. Errors are answered with status 400 and
+{"error": message}.
+"""
+import itertools
+import warnings
+import numpy as np
+import flask
+from data.dataset import SENTINELS
+from data.index import DIMENSIONS, fips_codes
+
+# query parameter of each ColumnIndex dimension
+PARAMS = dict(zip(DIMENSIONS, ('age', 'race', 'cod')))
+AGGREGATES = {
+    'mean': np.nanmean,
+    'sum': lambda values, axis: np.where(np.isnan(values).all(axis=axis), np.nan,
+                                         np.nansum(values, axis=axis)),
+    'min': np.nanmin,
+    'max': np.nanmax,
+    'count': lambda values, axis: np.sum(~np.isnan(values), axis=axis),
+}
+
+
+class QueryError(ValueError):
+    """A query that cannot be answered, reported to the client."""
+
+
+def split(value) -> list:
+    """'48,06' -> ['48', '06'], None and '' -> []"""
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+def codes(values, digits, name) -> list:
+    """FIPS codes of a query parameter as integers."""
+    if not all(v.isdigit() and len(v) <= digits for v in values):
+        raise QueryError('{} must be {} digit FIPS codes'.format(name, digits))
+    return [int(v) for v in values]
+
+
+class DeathsApi():
+
+    def __init__(self, server, dataset, url='/api/v1/deaths'):
+        """
+        Adds the query route to a Flask server.
+
+        Parameters
+        ----------
+        server : Flask server of the Dash app
+        dataset : function returning the current cause of death Dataset,
+                  so queries follow data reloads
+        url : route of the API
+        """
+        self.dataset = dataset
+        server.add_url_rule(url, 'deaths_api', self.serve)
+
+    def query(self, args) -> dict:
+        """Answer to the query parameters `args` (a dict like mapping)."""
+        dataset = self.dataset()
+        columns = dataset.column_index
+        wanted = {}
+        for dim, param in PARAMS.items():
+            values = split(args.get(param)) or ['*']
+            if '*' in values:
+                if len(values) > 1:
+                    raise QueryError('{}: * cannot be combined with values'.format(param))
+                wanted[dim] = None
+                continue
+            unknown = [v for v in values if v not in columns.values[dim]]
+            if unknown:
+                raise QueryError('unknown {} {}, expected one of {}'.format(
+                    param, ','.join(unknown), ','.join(columns.values[dim])))
+            wanted[dim] = values
+
+        agg = args.get('agg') or 'mean'
+        if agg not in AGGREGATES:
+            raise QueryError('agg must be one of ' + ', '.join(AGGREGATES))
+
+        # one series per combination of the listed values
+        groups = {}
+        for key, name in columns.match(**wanted):
+            series = tuple('*' if wanted[dim] is None else v
+                           for dim, v in zip(DIMENSIONS, key))
+            groups.setdefault(series, []).append(name)
+        order = itertools.product(*[wanted[dim] or ['*'] for dim in DIMENSIONS])
+        groups = {'_'.join(s): groups[s] for s in order if s in groups}
+        if not groups:
+            raise QueryError('no column matches the query')
+
+        states = codes(split(args.get('state')), 2, 'state')
+        counties = codes(split(args.get('fips')), 5, 'fips')
+        rows = dataset.fips_index.rows(states, counties)
+        df = dataset.df
+
+        series = {}
+        for name, cols in groups.items():
+            values = df[cols].to_numpy(dtype=np.float64)[rows]
+            values[np.isin(values, SENTINELS)] = np.nan
+            with warnings.catch_warnings():
+                # all invalid counties are null, not worth a warning
+                warnings.simplefilter('ignore', RuntimeWarning)
+                result = AGGREGATES[agg](values, axis=1)
+            series[name] = [None if np.isnan(v) else v.item() for v in result]
+        return {
+            'fips': ['{:05d}'.format(f) for f in fips_codes(df)[rows]],
+            'county': df['CHSI_County_Name'].to_numpy()[rows].tolist(),
+            'state': df['CHSI_State_Abbr'].to_numpy()[rows].tolist(),
+            'series': series,
+            'columns': groups,
+        }
+
+    def serve(self):
+        """The API view."""
+        try:
+            return flask.jsonify(self.query(flask.request.args))
+        except QueryError as e:
+            return flask.jsonify({'error': str(e)}), 400
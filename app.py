@@ -1,54 +1,133 @@
-import dash
+import os
+import sys
+import functools
+import hashlib
+import threading
+from types import MappingProxyType
+
+# CHSI_FAST_STARTUP=1 loads the snapshot in a background thread, so a
+# worker accepts connections as soon as the app is imported; requests wait
+# for the data (see wait_for_snapshot and benchmarks/startup.py). It also
+# keeps dash and plotly from importing IPython for their notebook support,
+# about a third of the import time; they run as if IPython was not
+# installed, which is all a server needs. In a notebook IPython is already
+# loaded and is used.
+FAST_STARTUP = bool(os.environ.get('CHSI_FAST_STARTUP'))
+hide_ipython = FAST_STARTUP and 'IPython' not in sys.modules
+if hide_ipython:
+	sys.modules['IPython'] = None
+try:
+	import dash
+	# dash.Dash imports it, and it asks for IPython as well
+	import plotly.offline
+finally:
+	# later imports of IPython work as usual
+	if hide_ipython:
+		del sys.modules['IPython']
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Input, Output
-import plotly.figure_factory as ff
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
-import colorlover
+try:
+	import flask_compress
+except ImportError:
+	flask_compress = None
 
 # importing Dataset wrapper class
-from data.dataset import Dataset
+from data.dataset import Dataset, SENTINELS, changed_states
+from data.store import DataStore, DOMAINS
+from data.index import FipsIndex, MEASURE, fips_codes
+from data.stats import Correlations, METHODS
+from data.tensor import quiet
+from data.geometry import CountyGeometry
+from data.scatter import (SLICENUM, PORTLAND, SCATTER_AGES, freeze,
+						  scatter_arrays as build_scatter_arrays)
+from figcache import FigureCache, apply_changes
+from responses import ResponseCache, FigureBundle
+from metrics import Metrics
+from hotreload import Watcher
+from api import DeathsApi
+import pipeline
+
+# startup phases and dataset loads are always timed, request metrics and
+# the /metrics route are only installed with CHSI_METRICS=1
+metrics = Metrics()
+METRICS = bool(os.environ.get('CHSI_METRICS'))
 
 
-# preload the cause of death and demographics dataset and preprocess it.
-cod = Dataset('./data/LEADINGCAUSESOFDEATH.csv')
-state_cod = cod.state_data()
-demogr = pd.read_csv('./data/DEMOGRAPHICS.csv')
+# the cause of death and demographics data are loaded into the data
+# snapshot further down (see Snapshot), which CHSI_RELOAD can replace.
+# CHSI_SHARED_DATA=1 memory maps the numeric columns from data/.cache
+# read only, so all gunicorn workers share one copy of them (see
+# benchmarks/memory.py).
+SHARED_DATA = bool(os.environ.get('CHSI_SHARED_DATA'))
+WARM_FIGURES = bool(os.environ.get('CHSI_WARM_FIGURES'))
+DATA_DIR = './data'
+CAUSES_OF_DEATH = './data/LEADINGCAUSESOFDEATH.csv'
+DATA_FILES = [CAUSES_OF_DEATH] + [os.path.join(DATA_DIR, f) for f in DOMAINS.values()]
+# county outlines for plot_choropleth, read from data/.cache on first use
+county_geometry = CountyGeometry('./data/.cache/geometry')
 
 #########################################################################
 # 3D Scatter
 #########################################################################
 
-def display_fig(in_age='A', in_slice=0, in_range=0):
+# CHSI_SCATTER_LOD=1 sends the compact scatter of scatter_lod: the faint
+# background of the sliced view decimated to one county per cell of a
+# LOD_BINS^3 grid (see data/scatter.py), x and the marker sizes rounded to
+# LOD_DECIMALS
+SCATTER_LOD = bool(os.environ.get('CHSI_SCATTER_LOD'))
+LOD_DECIMALS = {'x': 3, 'size': 1}
+
+def age_group(in_age):
+	"""Maps an age bracket to the first bracket sharing its y column."""
+	if in_age in ('A', 'B', 'C'):
+		return 'A'
+	if in_age in ('D', 'E'):
+		return 'D'
+	return in_age
+
+def scatter_arrays(in_age='A', data=None):
+	"""
+	Derived 3D scatter arrays for one age group (see data/scatter.py),
+	computed once per snapshot of the demographics (`data`, a ScatterData,
+	defaults to the current one).
+	"""
+	data = snapshot.scatter if data is None else data
+	arrays = data.arrays.get(in_age)
+	if arrays is None:
+		arrays = data.arrays[in_age] = build_scatter_arrays(data.demogr, in_age)
+	return arrays
+
+def scatter_slice(arrays, in_range=0):
+	"""
+	Points of one poverty slice from scatter_arrays: x, y and z of the
+	counties in the slice, the z grid of the slice plane and the slice color.
+	"""
+	if in_range<0 or in_range>SLICENUM:
+		in_range=0
+	slices = arrays['slices']
+	start, end = arrays['bounds'][in_range], arrays['bounds'][in_range+1]
+	x1 = arrays['x_sorted'][start:end]
+	y1 = arrays['y_sorted'][start:end]
+	z1 = [slices[in_range]] * len(x1)
+	p3 = [[slices[in_range]] * 5] * 5
+	return x1, y1, z1, p3, arrays['palette'][in_range]
+
+def display_fig(in_age='A', in_slice=0, in_range=0, data=None):
 	colorscales = ["Greens", "YlOrRd", "Bluered", "RdBu", "Reds",
                	       "Blues", "Picnic", "Rainbow", "Portland", "Jet",
                	       "Hot", "Blackbody", "Earth", "Electric", "Viridis",
                	       "Cividis"]
-	portland = [[0, 'rgb(12,51,131)'], [0.25, 'rgb(10,136,186)'],
-  	            [0.5, 'rgb(242,211,56)'], [0.75, 'rgb(242,143,56)'],
-  	            [1, 'rgb(217,30,30)']]
-	portland_rgb = [i[1] for i in portland]
-	cols = demogr.columns.tolist()
+	portland = PORTLAND
 	titlez = "Poverty (%)"
 	colorbarx = 0.95
 
-	# age
-	if in_age=='A' or in_age=='B' or in_age=='C':
-            y = demogr[cols[17]]
-            titley = "y = Age Under 19 (%)"
-	elif in_age=='D' or in_age=='E':
-            y = demogr[cols[20]]
-            titley = "y = Age 19-64 (%)"
-	elif in_age=='F':
-	    y = demogr[cols[23]] + demogr[cols[26]]
-	    titley = "y = Age Above 64 (%)"
-
-	# log10(population density), poverty
-	x = np.log10(demogr[cols[11]].replace([-2222,0], [demogr[cols[11]].mean(),1]))
-	z = demogr[cols[14]].replace(-2222.2, demogr[cols[14]].mean())
-	d = np.log10(demogr[cols[8]]) # log10(population)
+	arrays = scatter_arrays(age_group(in_age), data)
+	x, y, z = arrays['x'], arrays['y'], arrays['z']
+	titley = arrays['titley']
 
 	##############
 	if in_slice == 0:
@@ -59,7 +138,7 @@ def display_fig(in_age='A', in_slice=0, in_range=0):
 			z=z,
 			mode='markers',
 			marker=dict(
-				size=d*2,
+				size=arrays['size'],
 				color=z,                     # set color to an array/list of desired values
 				colorscale=colorscales[8],   # choose a colorscale
 				opacity=1,
@@ -81,22 +160,11 @@ def display_fig(in_age='A', in_slice=0, in_range=0):
 	##############
 	else:
 	##############
-	    # for slicing data
-		slicenum = 38
-		if in_range<0 or in_range>slicenum:
-			in_range=0
-		slices = np.linspace(0, max(z), slicenum)
-		condition = ((z >= slices[in_range]) & (z < slices[in_range+1]))
-		x1 = x[condition]
-		y1 = y[condition]
-		z1 = [slices[in_range]] * len(x1)
-		slicecolor =colorlover.interp(portland_rgb, slicenum)[in_range]
+	    # for slicing data, the slice is a precomputed row range
+		x1, y1, z1, p3, slicecolor = scatter_slice(arrays, in_range)
 
 	    # for creating a plane
-		p1 = np.linspace(0, max(x), 5)
-		p2 = np.linspace(0, max(y), 5)
-		p1, p2 = np.meshgrid(p1, p2)
-		p3 = [[slices[in_range]] * 5] * 5
+		p1, p2 = arrays['p1'], arrays['p2']
 
 		trace1 = go.Scatter3d(
 			x=x,
@@ -105,7 +173,7 @@ def display_fig(in_age='A', in_slice=0, in_range=0):
 			mode='markers',
 			name='county',
 			marker=dict(
-				size=d*2,
+				size=arrays['size'],
 				color="black",
 				opacity=0.01,
 				line=dict(width=0.00, color='black'),
@@ -155,7 +223,7 @@ def display_fig(in_age='A', in_slice=0, in_range=0):
                     name='Poverty',
                     mode='markers',
                     marker=dict(
-                        size=d*2,
+                        size=arrays['size'],
                         color=slicecolor,
                         opacity=1,
                         showscale=False,
@@ -191,13 +259,45 @@ def display_fig(in_age='A', in_slice=0, in_range=0):
 	fig = go.Figure(data=data, layout=layout)
 	return fig
 
-def plot_state_choro(df, age: str, cod: str):
+def scatter_key(in_age='A', in_slice=0, in_range=0):
 	"""
-	Plot state choropleth, adopted from georges code
+	Folds display_fig inputs that draw the same figure into one cache key:
+	age groups sharing a demographics column, and the slider position when
+	the data is not sliced.
 	"""
-	for col in df.columns:
-		df[col] = df[col].astype(str)
+	in_age = age_group(in_age)
+	if in_slice == 0:
+		return (in_age, 0, 0)
+	if in_range<0 or in_range>SLICENUM:
+		in_range=0
+	return (in_age, 1, in_range)
 
+def state_choro_arrays(df):
+	"""
+	z values and hover text for every age/cause column of the state frame,
+	built once so plot_state_choro only does lookups. The result is a
+	read-only mapping from column name ('D_HIV') to a (z, text) pair of
+	read-only arrays, plus the state abbreviations under
+	'locations'. Nothing in it can change, so threads can share it freely.
+	"""
+	# same string round trip the map has always used, on a private copy
+	df = df.astype(str)
+	# the map has always labelled every age group's hover text "Age 25-44"
+	prefix = df['State_Name'] + '<br>' + "Age 25-44: "
+	arrays = {'locations': tuple(df['State_Abbr'])}
+	for col in df.columns[3:]:
+		z = df[col].astype(float)
+		text = prefix + z.round(2).astype(str) + '%'
+		z, text = z.to_numpy().copy(), text.to_numpy(dtype=object).copy()
+		z.flags.writeable = text.flags.writeable = False
+		arrays[col] = (z, text)
+	return MappingProxyType(arrays)
+
+def plot_state_choro(hover, age: str, cod: str):
+	"""
+	Plot state choropleth, adopted from georges code. `hover` comes from
+	state_choro_arrays and is never modified.
+	"""
 	scl = [
 	    [0.0, 'rgb(242,240,247)'],
 	    [0.2, 'rgb(218,218,235)'],
@@ -207,38 +307,8 @@ def plot_state_choro(df, age: str, cod: str):
 	    [1.0, 'rgb(84,39,143)']
 	]
 
-	data = []
-	textb, textc, textd = "Age 1-14: ", "Age 15-24: ", "Age 25-44: "
-	B_Injury = age+'_'+cod
-	B_Homicide = age+'_'+cod
-	C_Injury = age+'_'+cod
-	C_Homicide = age+'_'+cod
-	C_Suicide = age+'_'+cod
-	D_Injury = age+'_'+cod
-	D_Homicide = age+'_'+cod
-	D_Suicide = age+'_'+cod
-	D_HIV = age+'_'+cod
-
-	df[B_Injury+' text'] = df['State_Name'] + '<br>' + \
-		textb+df[B_Injury].astype(float).round(2).astype(str)+'%'
-	df[B_Homicide+' text'] = df['State_Name'] + '<br>' + \
-		textb+df[B_Homicide].astype(float).round(2).astype(str) +'%'
-
-	df[C_Injury+' text'] = df['State_Name'] + '<br>' + \
-		textc + df[C_Injury].astype(float).round(2).astype(str) +'%'
-	df[C_Homicide+' text'] = df['State_Name'] + '<br>' + \
-		textc + df[C_Homicide].astype(float).round(2).astype(str) +'%'
-	df[C_Suicide+' text'] = df['State_Name'] + '<br>' + \
-		textc + df[C_Suicide].astype(float).round(2).astype(str) +'%'
-
-	df[D_Injury+' text'] = df['State_Name'] + '<br>' + \
-		textd + df[D_Injury].astype(float).round(2).astype(str) +'%'
-	df[D_Homicide+' text'] = df['State_Name'] + '<br>' + \
-		textd + df[D_Homicide].astype(float).round(2).astype(str) +'%'
-	df[D_Suicide+' text'] = df['State_Name'] + '<br>' + \
-		textd + df[D_Suicide].astype(float).round(2).astype(str) +'%'
-	df[D_HIV+' text'] = df['State_Name'] + '<br>' + \
-		textd + df[D_HIV].astype(float).round(2).astype(str) +'%'
+	locations = hover['locations']
+	z, text = hover[age+'_'+cod]
 
 	# colorbar propertiess
 	colorbarx = 0.85
@@ -252,70 +322,22 @@ def plot_state_choro(df, age: str, cod: str):
 	# hover text (no display of auto text)
 	hovertemplate = '<b>%{text}</b>'
 
-	trc1 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[B_Injury].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text=df[B_Injury+' text'], colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc2 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[B_Homicide].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[B_Homicide+' text'],colorscale = scl,
+	trace = dict(type='choropleth',autocolorscale = False,locations=locations,
+              z=z,locationmode='USA-states',
+              hovertemplate=hovertemplate, text=text, colorscale = scl,
               colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
                             title = "Percentage"),
               name='')
 
-	trc3 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[C_Injury].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[C_Injury+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc4 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[C_Homicide].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[C_Homicide+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc5 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[C_Suicide].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[C_Suicide+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-
-	trc6 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[D_Injury].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[D_Injury+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc7 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[D_Homicide].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[D_Homicide+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc8 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[D_Suicide].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[D_Suicide+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-	trc9 = dict(type='choropleth',autocolorscale = False,locations=df['State_Abbr'],
-              z=df[D_HIV].astype(float),locationmode='USA-states',
-              hovertemplate=hovertemplate, text = df[D_HIV+' text'],colorscale = scl,
-              colorbar=dict(x=colorbarx, y=colorbary, thickness=colorbarthickness, len=colorbarlen, outlinewidth=colorbaroutlinewidth,
-                            title = "Percentage"),
-              name='')
-
-	data = [trc1, trc2,trc3, trc4,trc5, trc6,trc7, trc8,trc9]
+	data = [trace]
 
 	layout = dict(#title='Leading Cause of Death in USA',
 				plot_bgcolor='#FFFFFF',
 				paper_bgcolor='#FFFFFF',
 				margin = dict(r=20, l=0, t=0, b=0),
 				showlegend=False,
+				# lasso or box select states to highlight their counties
+				dragmode='lasso',
 				#updatemenus=updatemenus,
 				geo = dict(scope = 'usa',projection = dict(type = 'albers usa'),
 				showlakes = True,lakecolor = '#F4F4F8'))#rgb(255, 255, 255)'))
@@ -323,25 +345,159 @@ def plot_state_choro(df, age: str, cod: str):
 	fig = go.Figure(data = data, layout = layout)
 	return fig
 
-def plot_choropleth(df):
+"""
+Validation-free figure builders used by the callbacks. go.Figure validates
+every array it is given and the result is then encoded again; here each
+figure skeleton is built and validated through go.Figure once, kept as a
+plain dict template, and only the input dependent arrays are swapped into a
+shallow copy of it. The returned dicts share arrays with the templates and
+must be treated as read-only.
+"""
+def scatter_lod(template, arrays, in_slice=0):
 	"""
-	This function generates and returns a choropleth from the input dataset.
+	Compact scatter_template for CHSI_SCATTER_LOD=1. x and the marker sizes
+	are rounded; in the sliced view the background cloud, drawn at opacity
+	0.01, keeps one county per grid cell, and the colorbar trace gets the
+	two bounds of its scale instead of a color per county. The counties of
+	the slice itself stay exact.
+	"""
+	x = arrays['x'].round(LOD_DECIMALS['x'])
+	size = arrays['size'].round(LOD_DECIMALS['size'])
+	if in_slice == 0:
+		return apply_changes(template, [[0, 'x', x], [0, 'marker.size', size]])
+	lod, z = arrays['lod'], arrays['z']
+	# trace 0 is the background, trace 2 only carries the colorbar
+	return apply_changes(template, [[0, 'x', x[lod]], [0, 'y', arrays['y'][lod]],
+									[0, 'z', z[lod]], [0, 'marker.size', size[lod]],
+									[2, 'marker.color', [z.min()]],
+									[2, 'marker.cmin', z.min()],
+									[2, 'marker.cmax', z.max()]])
+
+def scatter_template(in_age='A', in_slice=0, data=None):
+	data = snapshot.scatter if data is None else data
+	template = data.templates.get((in_age, in_slice))
+	if template is None:
+		template = display_fig(in_age, in_slice, 0, data).to_dict()
+		if SCATTER_LOD:
+			template = scatter_lod(template, scatter_arrays(in_age, data), in_slice)
+		data.templates[(in_age, in_slice)] = template
+	return template
+
+def display_fig_dict(in_age='A', in_slice=0, in_range=0, data=None):
+	"""display_fig as a plain dict, same figure JSON."""
+	data = snapshot.scatter if data is None else data
+	in_age, in_slice, in_range = scatter_key(in_age, in_slice, in_range)
+	template = scatter_template(in_age, in_slice, data)
+	if in_slice == 0:
+		return template
+	arrays = scatter_arrays(in_age, data)
+	x1, y1, z1, p3, slicecolor = scatter_slice(arrays, in_range)
+	# trace 1 is the slice plane, trace 3 the sliced counties
+	changes = [[1, 'z', tuple(p3)], [3, 'x', x1], [3, 'y', y1], [3, 'z', z1],
+			   [3, 'marker.color', slicecolor]]
+	if SCATTER_LOD:
+		# the sizes of the sliced counties rather than of all of them
+		start = arrays['bounds'][in_range]
+		size = arrays['size_sorted'][start:start + len(x1)]
+		changes.append([3, 'marker.size', size.round(LOD_DECIMALS['size'])])
+	return apply_changes(template, changes)
+
+def choro_template(data=None):
+	data = snapshot.choro if data is None else data
+	if data.template is None:
+		col = next(col for col in data.hover if col != 'locations')
+		data.template = plot_state_choro(data.hover, *col.split('_')).to_dict()
+	return data.template
+
+def plot_state_choro_dict(age: str, cod: str, data=None):
+	"""plot_state_choro of the state hover arrays as a plain dict, same figure JSON."""
+	data = snapshot.choro if data is None else data
+	z, text = data.hover[age+'_'+cod]
+	return apply_changes(choro_template(data), [[0, 'z', z], [0, 'text', text]])
+
+def plot_correlations(matrix, title):
+	"""
+	Heatmap of a Correlations.matrix frame, demographics down the side and
+	the cause of death columns along the bottom, labeled by cause and race.
+	"""
+	causes = [MEASURE.match(col).groups() for col in matrix.columns]
+	trace = go.Heatmap(z=matrix.to_numpy(),
+					   x=['{} ({})'.format(cause, race) for _, race, cause in causes],
+					   y=[col.replace('_', ' ') for col in matrix.index],
+					   zmin=-1, zmax=1, colorscale='RdBu', reversescale=True,
+					   colorbar=dict(thickness=5, len=0.8, outlinewidth=0),
+					   hovertemplate='%{y}<br>%{x}<br>r = %{z:.2f}<extra></extra>')
+	layout = go.Layout(title=dict(text=title, font=dict(size=13)),
+					   plot_bgcolor='#FFFFFF', paper_bgcolor='#FFFFFF',
+					   margin=dict(r=20, l=140, t=40, b=110), height=420,
+					   xaxis=dict(tickangle=-45, tickfont=dict(size=10)),
+					   yaxis=dict(autorange='reversed', tickfont=dict(size=10)))
+	return go.Figure(data=[trace], layout=layout)
+
+def plot_correlations_dict(age: str, method: str, state=0, data=None):
+	"""
+	Correlations of the demographics with the age group's cause of death
+	columns, over all counties (state 0) or those of one state.
+	"""
+	data = snapshot.corr if data is None else data
+	columns = [col for col in data.correlations.y_columns if col[0] == age]
+	# grouped by cause, races in header order
+	columns.sort(key=lambda col: MEASURE.match(col).group(3))
+	matrix = data.correlations.matrix(method, state or None, y=columns)
+	ages = {o['value']: o['label'] for o in ages_dropdown}
+	title = '{} correlation, {}, {}'.format(
+		method.capitalize(), ages[age], data.states.get(state, 'all counties'))
+	return plot_correlations(matrix, title).to_dict()
 
-	TODO: Add error checking.
+def plot_choropleth(df, level=2):
+	"""
+	This function generates and returns a choropleth from the input dataset.
+	County outlines come from the cached county geometry (data/geometry.py),
+	so any mix of states, up to the whole country, draws in milliseconds.
+	Counties are binned by value and each bin is one filled Scattergeo trace;
+	a transparent marker trace at the county centroids carries the hover text.
+	FIPS codes without an outline are reported with a warning.
 
 	Parameters
 	----------
 	df: a pandas dataframe with two columns; first column is `FIPS` for FIPS
 	    geoencoding. Second column is the features to be plotted, base on a
 		combination of age, ethnicity, and cause of death.
+	level: outline zoom level, 0 is full detail, higher is coarser
 	"""
 	colorscale = ["#f7fbff", "#ebf3fb", "#deebf7", "#d2e3f3", "#c6dbef", "#b3d2e9",
 				  "#9ecae1", "#85bcdb", "#6baed6", "#57a0ce", "#4292c6", "#3082be",
 				  "#2171b5", "#1361a9",	"#08519c", "#0b4083", "#08306b"]
 
-	fips = df.FIPS.tolist()
-	values = df.iloc[:,1].tolist()
-	endpts = list(np.linspace(1, 100, len(colorscale)-1))
+	fips = df.FIPS.astype(int).to_numpy()
+	values = df.iloc[:,1].to_numpy(dtype=float)
+	endpts = np.linspace(1, 100, len(colorscale)-1)
+	county_geometry.report(fips)
+
+	# bin i holds endpts[i-1] < value <= endpts[i], counties w/o data are skipped
+	bins = np.digitize(values, endpts, right=True)
+	bins[np.isnan(values)] = -1
+	labels = (['<= {:g}'.format(endpts[0])] +
+			  ['{:.2f} - {:.2f}'.format(a, b) for a, b in zip(endpts[:-1], endpts[1:])] +
+			  ['> {:g}'.format(endpts[-1])])
+
+	data = []
+	for i, color in enumerate(colorscale):
+		lon, lat = county_geometry.outlines(fips[bins == i], level)
+		if len(lon) == 0:
+			continue
+		data.append(go.Scattergeo(
+			lon=lon, lat=lat, mode='lines', fill='toself', fillcolor=color,
+			line=dict(color='rgb(244,24,244)', width=0.5),
+			name=labels[i], hoverinfo='skip',
+		))
+	clon, clat, names = county_geometry.centroids(fips)
+	data.append(go.Scattergeo(
+		lon=clon, lat=clat, mode='markers', marker=dict(opacity=0),
+		text=['{}<br>FIPS: {:05d}<br>Value: {}'.format(n, f, v)
+			  for n, f, v in zip(names, fips, values)],
+		hoverinfo='text', showlegend=False,
+	))
 
 	annotations = [dict(
 		showarrow = False,
@@ -361,19 +517,39 @@ def plot_choropleth(df):
     	autosize=False,
 		height=200,
     	width=400,
+		legend=dict(title=dict(text='% Death')),
+		geo = dict(scope = 'usa',projection = dict(type = 'albers usa'),
+				   showlakes = True,lakecolor = '#F4F4F8'),
 	)
+	return go.Figure(data=data, layout=layout)
 
-	fig = ff.create_choropleth(
-    	fips = fips, values = values, scope = ['Texas'],
-    	binning_endpoints = endpts, colorscale = colorscale,
-		simplify_county=0, simplify_state=0,
-    	show_hover = True, centroid_marker = {'opacity': 0},
-		county_outline={'color': 'rgb(244,24,244)', 'width': 0.5},
-    	asp = 2.9,
-    	legend_title = '% Death',
-		layout=layout,
-		)
-	return fig
+def county_values(cod, age, cods, state=0) -> pd.DataFrame:
+	"""
+	FIPS and the mean over all races of one age group and cause per county,
+	of one state or, for state 0, of every county. Invalid values are NaN.
+
+	Parameters
+	----------
+	cod: cause of death Dataset
+	age: age brackets
+	cods: causes of death
+	state: state FIPS code, 0 for the whole country
+	"""
+	columns = [name for _, name in cod.column_index.match(age=age, cause=cods)]
+	rows = cod.fips_index.rows([state] if state else [])
+	values = cod.df[columns].to_numpy(dtype=np.float64)[rows]
+	values[np.isin(values, SENTINELS)] = np.nan
+	return pd.DataFrame({'FIPS': fips_codes(cod.df)[rows],
+						 age+'_'+cods: quiet(np.nanmean, values, axis=1)})
+
+def plot_county_choro(age, cods, state, data=None):
+	"""
+	County choropleth of one state, or of the whole country at a coarser
+	outline level, drawn by plot_choropleth.
+	"""
+	data = snapshot.county if data is None else data
+	return plot_choropleth(county_values(data.cod, age, cods, state),
+						   level=1 if state else 3)
 
 """
 App layout. Have to use dash.Dash(__name__) and put css/js files in /assets
@@ -384,8 +560,17 @@ choropleth graph. The graph is dynamically updated w/ @callback by function
 update_graph, id='choropleth'.
 """
 # starting plotly Dash server and add bootstrap css style sheet
-app = dash.Dash(__name__)
+# gzip every response when flask-compress is installed
+app = dash.Dash(__name__, compress=flask_compress is not None)
 server = app.server
+if METRICS:
+	# selections are labeled by the scatter inputs only, not the selection
+	metrics.init_app(server, {'scatter3d.figure': scatter_key,
+							  'choropleth.figure': None,
+							  'correlations.figure': None,
+							  'county-choropleth.figure': None,
+							  'scatter3d-selection.data': lambda _, *inputs: scatter_key(*inputs),
+							  'choropleth-selection.data': lambda _, *inputs: scatter_key(*inputs)})
 app.config['suppress_callback_exceptions']=True
 
 # Set style basics
@@ -510,17 +695,262 @@ app.layout = html.Div([
 	], style = {'width': '98%', 'margin-top':'5rem','fontSize': '10px'})
 ])
 
-@app.callback(Output("scatter3d", "figure"),
-			 [Input("ages", "value"),
-              Input("radio1", "value"),
-              Input('slider1', "value")])
+"""
+Data snapshot and figure caches. Everything the callbacks draw from lives
+in one Snapshot: the cause of death Dataset, the FIPS indexed store, and per
+graph the source table with the arrays, templates and figure cache derived
+from it. Every callback input combination is drawn once per snapshot and
+served from memory afterwards. Set CHSI_WARM_FIGURES=1 to draw the whole
+input grid at startup instead of on first request.
+
+A snapshot is never modified once published. With CHSI_RELOAD=<seconds> a
+watcher polls the csv files and reload_data builds and warms the next
+snapshot in the background, then swaps the module level `snapshot`. Each
+callback reads `snapshot` once, so requests in flight finish on the data
+they started with, and nobody waits for a rebuild.
+"""
+class ScatterData():
+
+	def __init__(self, demogr, arrays=None):
+		"""
+		Demographics with the 3D scatter arrays, templates and figures.
+		`arrays` are already computed scatter arrays by age group.
+		"""
+		self.demogr = demogr
+		# scatter points are demographics rows, in FIPS order
+		self.fips_index = FipsIndex(demogr.index)
+		self.arrays = dict(arrays or {})
+		self.templates = {}
+		self.figures = FigureCache(functools.partial(display_fig_dict, data=self),
+								   maxsize=256, key=scatter_key)
+
+class ChoroData():
+
+	def __init__(self, state_cod):
+		"""State table with the choropleth hover arrays, template and figures."""
+		self.state_cod = state_cod
+		self.hover = state_choro_arrays(state_cod)
+		# map locations are the rows of the state table
+		self.states = {code: i for i, code in enumerate(state_cod['State_FIPS_Code'])}
+		self.codes = dict(zip(state_cod['State_Abbr'], state_cod['State_FIPS_Code']))
+		self.template = None
+		self.figures = FigureCache(functools.partial(plot_state_choro_dict, data=self),
+								   maxsize=64)
+
+def state_names(demogr):
+	"""{state FIPS code: state name} of a demographics frame, by code."""
+	return dict(sorted(zip(demogr['State_FIPS_Code'].tolist(),
+						   demogr['CHSI_State_Name'].tolist())))
+
+class CorrData():
+
+	def __init__(self, store):
+		"""Demographics x cause of death correlations with their heatmap figures."""
+		self.correlations = Correlations(store)
+		self.states = state_names(store.domain('demographics'))
+		self.figures = FigureCache(functools.partial(plot_correlations_dict, data=self),
+								   maxsize=128)
+
+class CountyData():
+
+	def __init__(self, cod):
+		"""Cause of death Dataset with its county choropleth figures."""
+		self.cod = cod
+		self.figures = FigureCache(functools.partial(plot_county_choro, data=self),
+								   maxsize=64)
+
+class Snapshot():
+
+	def __init__(self, version, cod, store, scatter, choro, corr, county):
+		"""
+		One version of the CHSI data and everything derived from it.
+
+		Parameters
+		----------
+		version: data_version() of the csv files it was loaded from
+		cod: cause of death Dataset
+		store: DataStore, its demographics domain is `scatter.demogr`
+		scatter: ScatterData
+		choro: ChoroData of cod's state table
+		corr: CorrData of `store`
+		county: CountyData of `cod`
+		"""
+		self.version = version
+		self.cod = cod
+		self.store = store
+		self.scatter = scatter
+		self.choro = choro
+		self.corr = corr
+		self.county = county
+
+	def warm(self):
+		"""
+		Draws every figure reachable from the dropdowns, radio and slider,
+		and the national correlation heatmaps.
+		"""
+		self.choro.figures.warm(choro_grid(self))
+		self.scatter.figures.warm(scatter_grid())
+		self.corr.correlations.national()
+		self.corr.figures.warm(corr_grid())
+
+def data_version():
+	"""
+	Short hash of the size and mtime of the csv files. Workers that loaded
+	the same files agree on it, however often each of them reloaded.
+	"""
+	signatures = [Watcher.signature(f) for f in DATA_FILES]
+	return hashlib.sha1(repr(signatures).encode()).hexdigest()[:12]
+
+def load_snapshot():
+	"""
+	The startup snapshot, loading the cause of death and demographics data.
+	The state table, scatter arrays and national correlation matrices are
+	taken from the artifacts of `python pipeline.py` when they are fresh,
+	and computed otherwise.
+	"""
+	version = data_version()
+	with metrics.load('leading_causes_of_death'):
+		cod = Dataset(CAUSES_OF_DEATH, mmap=SHARED_DATA)
+	with metrics.phase('state_data'):
+		state_cod = pipeline.load('state_data')
+		if state_cod is None:
+			state_cod = cod.state_data()
+	with metrics.phase('data_store'):
+		store = DataStore(DATA_DIR, mmap=SHARED_DATA)
+	with metrics.load('demographics'):
+		demogr = store.domain('demographics')
+	with metrics.phase('scatter_arrays'):
+		arrays = {age: pipeline.load('scatter_arrays_' + age) for age in SCATTER_AGES}
+		arrays = {age: a for age, a in arrays.items() if a is not None}
+		for a in arrays.values():
+			freeze(a)
+	with metrics.phase('state_choro_arrays'):
+		choro = ChoroData(state_cod)
+	with metrics.phase('national_correlations'):
+		corr = CorrData(store)
+		matrices = pipeline.load('national_correlations')
+		if matrices is None:
+			matrices = corr.correlations.national()
+		corr.correlations.seed(matrices)
+	return Snapshot(version, cod, store, ScatterData(demogr, arrays), choro, corr,
+					CountyData(cod))
+
+# set by publish, at import or by the loader thread of CHSI_FAST_STARTUP
+snapshot = None
+snapshot_ready = threading.Event()
+
+def scatter_grid():
+	"""update_3dscatter inputs reachable from the dropdown, radio and slider."""
+	ages = [o['value'] for o in ages_dropdown]
+	return ([(age, 0, 0) for age in ages] +
+			[(age, 1, value) for age in ages for value in range(0, 31)])
+
+def choro_grid(snap=None):
+	"""update_choro inputs reachable from the dropdowns."""
+	state_cod = (snapshot if snap is None else snap).choro.state_cod
+	ages = [o['value'] for o in ages_dropdown]
+	causes = [o['value'] for o in causes_dropdown]
+	# not every age group has every cause, e.g. there is no B_HIV column
+	return [(age, cause) for age in ages for cause in causes
+			if age+'_'+cause in state_cod.columns]
+
+def corr_grid():
+	"""update_correlations inputs for all counties."""
+	return [(o['value'], method, 0) for o in ages_dropdown for method in METHODS]
+
+def county_grid(snap=None):
+	"""update_county_choro inputs reachable from the dropdowns."""
+	snap = snapshot if snap is None else snap
+	states = [0] + list(snap.corr.states)
+	return [args + (state,) for args in choro_grid(snap) for state in states]
+
+def warm_figures():
+	"""Draws every figure reachable from the dropdowns, radio and slider."""
+	snapshot.warm()
+
+def bundle_figures(snap):
+	"""FigureBundle figures of a snapshot."""
+	return {'scatter': (snap.scatter.figures, scatter_grid()),
+			'choropleth': (snap.choro.figures, choro_grid(snap))}
+
+# every figure of the grid as a static, precompressed blob with an ETag,
+# e.g. /figures/scatter/D,1,10 and the /figures/index.json listing
+bundle = FigureBundle(server, {})
+
+def publish(snap):
+	"""Makes `snap` the snapshot every callback and route reads from."""
+	global snapshot
+	snapshot = snap
+	bundle.update(bundle_figures(snap))
+	metrics.cache('scatter_figures', snap.scatter.figures)
+	metrics.cache('choro_figures', snap.choro.figures)
+	metrics.cache('correlations', snap.corr.correlations)
+	metrics.cache('corr_figures', snap.corr.figures)
+	metrics.cache('county_figures', snap.county.figures)
+	# requests outside the grids share one key label
+	metrics.grid('scatter3d.figure', scatter_grid())
+	metrics.grid('choropleth.figure', choro_grid(snap))
+	metrics.grid('correlations.figure', corr_grid())
+	metrics.grid('county-choropleth.figure', county_grid(snap))
+	for graph in ('scatter3d', 'choropleth'):
+		metrics.grid(graph+'-selection.data', [(None,) + args for args in scatter_grid()])
+	snapshot_ready.set()
+
+def warm():
+	"""CHSI_WARM_FIGURES: every figure and the /figures bundle."""
+	with metrics.phase('warm_figures'):
+		warm_figures()
+	with metrics.phase('figure_bundle'):
+		bundle.build()
+
+def load_in_background():
+	"""Loader thread of CHSI_FAST_STARTUP."""
+	try:
+		with metrics.phase('snapshot'):
+			publish(load_snapshot())
+	finally:
+		# a failed load is answered with 503s instead of hanging requests
+		snapshot_ready.set()
+	if WARM_FIGURES:
+		warm()
+
+loaders = {}
+loaders_lock = threading.Lock()
+
+def start_loading():
+	"""
+	Starts the loader thread of this process, once. A worker forked from a
+	--preload master inherits no threads, so it starts its own.
+	"""
+	with loaders_lock:
+		if os.getpid() not in loaders and not snapshot_ready.is_set():
+			loader = threading.Thread(target=load_in_background, name='chsi-loader',
+									  daemon=True)
+			loaders[os.getpid()] = loader
+			loader.start()
+
+def wait_for_snapshot():
+	"""before_request hook of CHSI_FAST_STARTUP, holds requests until the data is in."""
+	if not snapshot_ready.is_set():
+		start_loading()
+		snapshot_ready.wait()
+	if snapshot is None:
+		return 'CHSI data failed to load, see the server log', 503
+
+if FAST_STARTUP:
+	# registered before the response cache's hook, which reads the snapshot
+	server.before_request(wait_for_snapshot)
+else:
+	with metrics.phase('snapshot'):
+		publish(load_snapshot())
+
+# slices of the cause of death table as JSON, e.g.
+# /api/v1/deaths?age=D&race=*&cod=Homicide&state=48 (see api.py)
+DeathsApi(server, lambda: snapshot.cod)
+
 def update_3dscatter(input1, input2, input3):
-  return display_fig(in_age=input1, in_slice=input2, in_range=input3)
+  return snapshot.scatter.figures(input1, input2, input3)
 
-@app.callback(Output('choropleth', 'figure'),
- 			 [Input('ages', 'value'),
-			  #Input('ethnicities', 'value'),
-			  Input('cods', 'value')])
 def update_choro(age, cods):
 	"""
 	This is the callback function that dynamically adjusts the choropleth by
@@ -533,37 +963,245 @@ def update_choro(age, cods):
 	age: age brackets
 	cods: causes of death
 	"""
-	return plot_state_choro(state_cod, age, cods)
-
-#@app.callback(Output('choropleth', 'figure'),
-# 			 [Input('ages', 'value'),
-#			  Input('ethnicities', 'value'),
-#			  Input('cods', 'value')])
-#def update_choro(age, ethnicities, cods):
-#	"""
-#	This is the callback function that dynamically adjusts the choropleth by
-#	taking inputs from the dropdown menus, calling the Dataset class to lookup
-#	the appropriate column, get the data slices with FIPS and feature column.
-#	It then returns a choropleth figure by calling plot_choropleth.
-#
-#	NOTE: if NaN values are plotted, the mouseover data inpsection will not work
-#	Instead, fillna with 0 so every polygon is plotted.
-#
-#	Parameters
-#	----------
-#	age: age brackets
-#	ethnicities: ethnicities
-#	cods: causes of death
-#	"""
-#	if cod.isin_cols(age, ethnicities, cods):
-#		slices = cod.lookup(age, ethnicities, cods)
-#	else:
-#		# if age/ethnicities/cods combination dont exist, plot default graph.
-#		slices = cod.lookup('D', 'Wh', 'Homicide')
-#
-#	tx_slices = slices[slices.FIPS.str.startswith("48")].fillna(0)
-#	return plot_choropleth(tx_slices)
+	return snapshot.choro.figures(age, cods)
+
+"""
+Delta update mode, CHSI_DELTA_UPDATES=1. Instead of a whole figure, the
+server callbacks write a delta into a dcc.Store next to each graph: the full
+figure once per session (or when the figure skeleton changes), afterwards
+only the trace values that changed, e.g. the choropleth z/text or the slice
+trace. A clientside callback (assets/delta.js) patches the figure the graph
+already shows. A second store keeps the key of that figure, which is sent
+back as State so the server knows what to diff against.
+"""
+DELTA_UPDATES = bool(os.environ.get('CHSI_DELTA_UPDATES'))
+
+# the client keeps [data version, figure key] of the figure it shows; a
+# figure drawn from an older snapshot is replaced whole after a reload
+def base_key(base, snap):
+	"""Figure key of the client's [version, key] State, None if unusable."""
+	if isinstance(base, list) and len(base) == 2 and base[0] == snap.version:
+		return base[1]
+	return None
+
+def update_3dscatter_delta(input1, input2, input3, base):
+	snap = snapshot
+	base = base_key(base, snap)
+	delta = snap.scatter.figures.delta(base, input1, input2, input3)
+	return delta, [snap.version, delta['key']]
+
+def update_choro_delta(age, cods, base):
+	snap = snapshot
+	base = base_key(base, snap)
+	delta = snap.choro.figures.delta(base, age, cods)
+	return delta, [snap.version, delta['key']]
+
+def delta_callback(graph, func, inputs):
+	"""Wires func up as the delta producing callback of a dcc.Graph id."""
+	app.layout.children.extend([dcc.Store(id=graph+'-delta'),
+								dcc.Store(id=graph+'-key')])
+	app.callback([Output(graph+'-delta', 'data'), Output(graph+'-key', 'data')],
+				 inputs, [State(graph+'-key', 'data')])(func)
+	app.clientside_callback(ClientsideFunction('chsi', 'apply_delta'),
+							Output(graph, 'figure'),
+							[Input(graph+'-delta', 'data')],
+							[State(graph, 'figure')])
+
+scatter_inputs = [Input("ages", "value"),
+				  Input("radio1", "value"),
+				  Input('slider1', "value")]
+choro_inputs = [Input('ages', 'value'),
+				#Input('ethnicities', 'value'),
+				Input('cods', 'value')]
+timed = metrics.timed if METRICS else (lambda func: func)
+responses = None
+if DELTA_UPDATES:
+	delta_callback("scatter3d", timed(update_3dscatter_delta), scatter_inputs)
+	delta_callback('choropleth', timed(update_choro_delta), choro_inputs)
+else:
+	app.callback(Output("scatter3d", "figure"), scatter_inputs)(timed(update_3dscatter))
+	app.callback(Output('choropleth', 'figure'), choro_inputs)(timed(update_choro))
+	# whole figure responses only depend on the inputs, so repeat requests
+	# are answered with the already encoded JSON
+	responses = ResponseCache(server, {'scatter3d.figure': scatter_key,
+									   'choropleth.figure': None,
+									   'correlations.figure': None})
+	metrics.cache('responses', responses)
+
+"""
+Cross filtering. States lasso or box selected on the map highlight their
+counties in the 3D scatter, and a county clicked in the scatter selects its
+state on the map (3D plots have no lasso). The server only maps selections
+to point positions through the FIPS indexes; the clientside chsi.select
+(assets/selection.js) applies them to the figures the browser already
+has, so a selection never rebuilds or resends a figure.
+"""
+def select_counties(selected, in_age, in_slice, in_range):
+	"""
+	Positions of the counties of the selected states in the scatter trace
+	that draws them: all counties in trace 0, or the slice in trace 3.
+	"""
+	if not selected or not selected.get('points'):
+		return None
+	snap = snapshot
+	codes = snap.choro.codes
+	states = [codes[p['location']] for p in selected['points']
+			  if p.get('location') in codes]
+	rows = snap.scatter.fips_index.rows(states) if states else np.array([], int)
+	in_age, in_slice, in_range = scatter_key(in_age, in_slice, in_range)
+	if in_slice == 0:
+		return {'trace': 0, 'points': rows.tolist()}
+	arrays = scatter_arrays(in_age, snap.scatter)
+	start, end = arrays['bounds'][in_range], arrays['bounds'][in_range+1]
+	position = arrays['position'][rows]
+	points = np.sort(position[(position >= start) & (position < end)]) - start
+	return {'trace': 3, 'points': points.tolist()}
+
+def select_state(click, in_age, in_slice, in_range):
+	"""Map position of the state of the county clicked in the scatter."""
+	if not click or not click.get('points'):
+		return None
+	point = click['points'][0]
+	curve, n = point.get('curveNumber'), point.get('pointNumber')
+	snap = snapshot
+	in_age, in_slice, in_range = scatter_key(in_age, in_slice, in_range)
+	arrays = scatter_arrays(in_age, snap.scatter)
+	if curve == 0:
+		# the background of the sliced view may be decimated
+		row = arrays['lod'][n] if in_slice and SCATTER_LOD else n
+	elif curve == 3 and in_slice:
+		row = arrays['order'][arrays['bounds'][in_range] + n]
+	else:
+		return None
+	state = int(snap.scatter.demogr.index[row]) // 1000
+	if state not in snap.choro.states:
+		return None
+	return {'trace': 0, 'points': [snap.choro.states[state]], 'native': True}
+
+def selection_callback(graph, source, func):
+	"""Wires func up to turn `source` into the selection shown on graph."""
+	app.layout.children.extend([dcc.Store(id=graph+'-selection'),
+								dcc.Store(id=graph+'-selected')])
+	app.callback(Output(graph+'-selection', 'data'),
+				 [source] + scatter_inputs)(timed(func))
+	app.clientside_callback(ClientsideFunction('chsi', 'select'),
+							Output(graph+'-selected', 'data'),
+							[Input(graph+'-selection', 'data')],
+							[State(graph+'-selection', 'id')])
+
+selection_callback('scatter3d', Input('choropleth', 'selectedData'), select_counties)
+selection_callback('choropleth', Input('scatter3d', 'clickData'), select_state)
+
+"""
+Correlation panel. A heatmap below the two plots correlates every
+demographics measure with the cause of death columns of the selected age
+group, over all counties or the counties of one state (see data/stats.py).
+Matrices and figures are cached per snapshot.
+"""
+def update_correlations(age, method, state):
+	return snapshot.corr.figures(age, method, state)
+
+if snapshot is not None:
+	states = snapshot.corr.states
+else:
+	# the layout is built before the loader thread is done, two csv columns
+	# give the same names
+	states = state_names(pd.read_csv(os.path.join(DATA_DIR, DOMAINS['demographics']),
+									 usecols=['State_FIPS_Code', 'CHSI_State_Name']))
+states_dropdown = [{'label': 'All states', 'value': 0}] + [
+	{'label': name, 'value': code} for code, name in states.items()]
+# between the plots and the disclaimer
+app.layout.children.insert(2, html.Div([
+	html.Div([
+		dcc.RadioItems(id='corr-method',
+					   options=[{'label': m.capitalize(), 'value': m} for m in METHODS],
+					   value='pearson',
+					   labelStyle={'display': 'inline-block'}),
+	], style = {'width': '30%', 'display':'inline-block'}),
+	html.Div([
+		dcc.Dropdown(id='corr-state',
+					 options=states_dropdown,
+					 multi=False, clearable=False, value=0),
+	], style = {'width': '31%', 'display':'inline-block'}),
+	dcc.Graph(id='correlations'),
+], style = {'width': '98%', 'fontSize': '13px', 'margin-top':'2rem'}))
+
+app.callback(Output('correlations', 'figure'),
+			 [Input('ages', 'value'), Input('corr-method', 'value'),
+			  Input('corr-state', 'value')])(timed(update_correlations))
+
+"""
+County map. A county choropleth of the selected age group and cause, below
+the correlation panel, for one state or the whole country. Outlines come
+from the county geometry cache (data/geometry.py), figures are cached per
+snapshot like the other graphs.
+"""
+def update_county_choro(age, cods, state):
+	return snapshot.county.figures(age, cods, state)
+
+app.layout.children.insert(3, html.Div([
+	html.Div([
+		dcc.Dropdown(id='county-state',
+					 options=states_dropdown,
+					 multi=False, clearable=False, value=48),
+	], style = {'width': '31%', 'display':'inline-block'}),
+	dcc.Graph(id='county-choropleth'),
+], style = {'width': '98%', 'fontSize': '13px', 'margin-top':'2rem'}))
+
+app.callback(Output('county-choropleth', 'figure'),
+			 [Input('ages', 'value'), Input('cods', 'value'),
+			  Input('county-state', 'value')])(timed(update_county_choro))
+
+
+def reload_data(changed):
+	"""
+	Watcher callback for changed csv files. Builds the next snapshot,
+	reloading only what depends on a changed file: the state table is only
+	recomputed for the states whose counties changed, and unchanged tables
+	keep their arrays and figures. The new snapshot is warmed, then swapped
+	in, and the response caches are dropped.
+	"""
+	old = snapshot
+	version = data_version()
+	changed = {os.path.abspath(f) for f in changed}
+	cod, choro = old.cod, old.choro
+	if os.path.abspath(CAUSES_OF_DEATH) in changed:
+		cod = Dataset(CAUSES_OF_DEATH, mmap=SHARED_DATA)
+		states = changed_states(old.cod.df, cod.df)
+		if states is None:
+			choro = ChoroData(cod.state_data())
+		elif states:
+			choro = ChoroData(cod.update_state_data(old.choro.state_cod, states))
+	store = old.store.refresh(changed)
+	demogr = store.domain('demographics')
+	scatter = old.scatter if demogr is old.scatter.demogr else ScatterData(demogr)
+	corr = old.corr if store is old.store else CorrData(store)
+	county = old.county if cod is old.cod else CountyData(cod)
+
+	new = Snapshot(version, cod, store, scatter, choro, corr, county)
+	new.warm()
+	publish(new)
+	if responses is not None:
+		responses.clear()
+
+# CHSI_RELOAD=<seconds> polls the csv files at that interval; every worker
+# process starts its own watcher thread on its first request
+RELOAD = float(os.environ.get('CHSI_RELOAD') or 0)
+if RELOAD:
+	watcher = Watcher(DATA_FILES, reload_data, interval=RELOAD)
+	server.before_request(watcher.start)
+
+# a --preload master must not fork with the loader running, so under
+# gunicorn (its master sets SERVER_SOFTWARE) each worker starts its own from
+# gunicorn.conf.py, or else on its first request
+GUNICORN = os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn/')
 
+if FAST_STARTUP:
+	# last, everything the loader calls is defined by now
+	if not GUNICORN:
+		start_loading()
+elif WARM_FIGURES:
+	warm()
 
 if __name__ == '__main__':
     app.run_server(debug=True)
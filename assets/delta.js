@@ -0,0 +1,30 @@
+/*
+ * Applies figure deltas sent by the server in delta update mode
+ * (CHSI_DELTA_UPDATES=1). A delta either carries a whole figure, or a list
+ * of [trace index, dotted path, value] changes for the figure the graph
+ * already shows. See FigureCache.delta in figcache.py.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    chsi: {
+        apply_delta: function(delta, figure) {
+            if (!delta) {
+                return figure;
+            }
+            if (delta.figure) {
+                return delta.figure;
+            }
+            // copy every object on a changed path, so plotly sees new
+            // references for exactly the parts that changed
+            var data = figure.data.slice();
+            delta.changes.forEach(function(change) {
+                var keys = change[1].split('.');
+                var obj = data[change[0]] = Object.assign({}, data[change[0]]);
+                for (var i = 0; i < keys.length - 1; i++) {
+                    obj = obj[keys[i]] = Object.assign({}, obj[keys[i]]);
+                }
+                obj[keys[keys.length - 1]] = change[2];
+            });
+            return {data: data, layout: figure.layout};
+        }
+    }
+});
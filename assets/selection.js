@@ -0,0 +1,74 @@
+/*
+ * Shows the cross filter selections computed by the server (see
+ * select_counties and select_state in app.py) on the figures the browser
+ * already has. A selection is {trace, points, native}: on the map the
+ * points are set as the trace's selectedpoints, on the 3D scatter, which has
+ * no selectedpoints, they are drawn as an outline trace from the trace's own
+ * coordinates. Figure updates replace the data, so the selection is applied
+ * again after every plot.
+ */
+(function() {
+    var OUTLINE = 'chsi-selection';
+
+    function outlineIndex(gd) {
+        for (var i = 0; i < gd.data.length; i++) {
+            if (gd.data[i].uid === OUTLINE) {
+                return i;
+            }
+        }
+        return -1;
+    }
+
+    function apply(gd) {
+        var selection = gd._chsiSelection;
+        var source = selection && gd.data[selection.trace];
+        if (selection && selection.native) {
+            if (source && JSON.stringify(source.selectedpoints || null) !==
+                    JSON.stringify(selection.points)) {
+                Plotly.restyle(gd, {selectedpoints: [selection.points]}, [selection.trace]);
+            }
+            return;
+        }
+        var outline = outlineIndex(gd);
+        if (outline >= 0 && gd.data[outline].meta === gd._chsiApplied) {
+            return;
+        }
+        if (outline >= 0) {
+            Plotly.deleteTraces(gd, outline);
+        }
+        if (!source || !selection.points.length) {
+            return;
+        }
+        var pick = function(values) {
+            return selection.points.map(function(i) { return values[i]; });
+        };
+        gd._chsiApplied = (gd._chsiApplied || 0) + 1;
+        Plotly.addTraces(gd, {
+            type: 'scatter3d', mode: 'markers', uid: OUTLINE,
+            meta: gd._chsiApplied, name: 'selection', showlegend: false,
+            hoverinfo: 'skip',
+            x: pick(source.x), y: pick(source.y), z: pick(source.z),
+            marker: {size: 5, symbol: 'circle-open', color: '#222',
+                     line: {width: 1, color: '#222'}}
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside);
+    window.dash_clientside.chsi = Object.assign({}, window.dash_clientside.chsi, {
+        select: function(selection, id) {
+            var graph = id.replace(/-selection$/, '');
+            var gd = document.querySelector('#' + graph + ' .js-plotly-plot');
+            if (!gd || !gd.data) {
+                return window.dash_clientside.no_update;
+            }
+            gd._chsiSelection = selection;
+            gd._chsiApplied = undefined;
+            if (!gd._chsiListening) {
+                gd._chsiListening = true;
+                gd.on('plotly_afterplot', function() { apply(gd); });
+            }
+            apply(gd);
+            return selection ? selection.points.length : 0;
+        }
+    });
+})();
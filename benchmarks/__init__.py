@@ -0,0 +1,12 @@
+"""Benchmarks for the CHSI dataset and the Dash figure builders."""
+import time
+
+
+def best_of(func, repeat=5) -> float:
+    """Best wall time of `repeat` calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
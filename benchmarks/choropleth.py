@@ -0,0 +1,41 @@
+"""
+Render time regression check for the state choropleth.
+
+Builds the figure for every age/cause pair on the map, serializes it the way
+Dash does and fails if building and encoding it takes longer than `--max-ms`.
+The trace count and payload size are checked by tests/test_choropleth.py.
+Run from the repo root with ``python -m benchmarks.choropleth``.
+"""
+import argparse
+import json
+import sys
+import plotly
+from benchmarks import best_of
+
+
+def encode(fig) -> str:
+    """Figure JSON as sent by the Dash update endpoint."""
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-ms', type=float, default=25.0)
+    args = parser.parse_args(argv)
+
+    import app
+    failed = False
+    for col in app.snapshot.choro.state_cod.columns[3:]:
+        age, cause = col.split('_')
+        build = lambda: encode(app.plot_state_choro(app.snapshot.choro.hover, age, cause))
+        size = len(build())
+        ms = best_of(build) * 1e3
+        ok = ms <= args.max_ms
+        failed |= not ok
+        print('{:<12} {:7d} bytes  {:6.2f} ms  {}'.format(
+            col, size, ms, 'ok' if ok else 'FAIL'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Figure construction paths of the two Dash callbacks, side by side.
+
+For a sample of inputs per callback this times
+  figure : building a validated go.Figure and encoding it
+  dict   : patching the cached dict template and encoding it
+  cached : a repeat request answered by the ResponseCache
+and checks that the figure and dict paths encode to the same JSON.
+Run from the repo root with ``python -m benchmarks.figures``.
+"""
+import sys
+from benchmarks import best_of
+from benchmarks.choropleth import encode
+
+
+def update_request(output, inputs) -> dict:
+    """Body of a Dash update request for one output and its input values."""
+    component, prop = output.split('.')
+    return {'output': output, 'outputs': {'id': component, 'property': prop},
+            'inputs': [{'id': i, 'property': 'value', 'value': v}
+                       for i, v in inputs],
+            'changedPropIds': [inputs[0][0] + '.value']}
+
+
+def main(argv=None):
+    import app
+    client = app.server.test_client()
+    cases = [
+        ('scatter3d.figure', app.display_fig, app.display_fig_dict,
+         [(('ages', age), ('radio1', s), ('slider1', r))
+          for age in 'ADF' for s, r in ((0, 0), (1, 5), (1, 20))]),
+        ('choropleth.figure',
+         lambda age, cause: app.plot_state_choro(app.snapshot.choro.hover, age, cause),
+         app.plot_state_choro_dict,
+         [(('ages', age), ('cods', cause)) for age in 'CD'
+          for cause in ('Injury', 'Homicide', 'Suicide')]),
+    ]
+    print('{:<18} {:>9} {:>9} {:>9}'.format('ms per request', 'figure',
+                                            'dict', 'cached'))
+    for output, figure, template, inputs in cases:
+        totals = [0.0, 0.0, 0.0]
+        for values in inputs:
+            args = [v for _, v in values]
+            assert encode(figure(*args)) == encode(template(*args)), args
+            body = update_request(output, values)
+            request = lambda: client.post('/_dash-update-component', json=body)
+            request()
+            totals[0] += best_of(lambda: encode(figure(*args)))
+            totals[1] += best_of(lambda: encode(template(*args)))
+            totals[2] += best_of(request)
+        print('{:<18} {:9.2f} {:9.2f} {:9.2f}'.format(
+            output, *(t / len(inputs) * 1e3 for t in totals)))
+    if getattr(app, 'responses', None) is not None:
+        print('response cache', app.responses.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
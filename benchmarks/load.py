@@ -0,0 +1,287 @@
+"""
+End to end load test of the Dash app's callback endpoint.
+
+Virtual users replay what the browser sends while someone plays with the
+controls: each step changes one of ages, cods, radio1 or slider1 and POSTs
+the update request of every figure that depends on it to
+/_dash-update-component, then waits a think time (exponential, mean
+--think ms). Requests go to
+  client    : the Flask test client of app.server, in process, one thread
+              per user; no sockets at all
+  gunicorn  : a local `gunicorn app:server --preload` on 127.0.0.1, started
+              for every --config WORKERSxTHREADS and stopped afterwards
+Each run reports latency percentiles of the successful requests, overall and
+per output, throughput, errors and the memory of every serving process
+(see benchmarks/memory.py). Runs are done on a fixed seed, so configurations
+see the same traffic; --json writes all results for later comparison.
+
+  python -m benchmarks.load --users 8 --seconds 20 --think 100
+  python -m benchmarks.load --target gunicorn --config 1x1 2x1 4x1 2x4
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+from benchmarks.figures import update_request
+from benchmarks.memory import smaps_rollup
+
+URL = '/_dash-update-component'
+# the controls of app.py and the figures each of them updates
+CONTROLS = {
+    'ages': ['B', 'C', 'D'],
+    'cods': ['Injury', 'Suicide', 'Homicide', 'HIV'],
+    'radio1': [0, 1],
+    'slider1': list(range(0, 31)),
+}
+# controls that are not swept keep their initial value
+FIXED = {'corr-method': 'pearson', 'corr-state': 0}
+OUTPUTS = {
+    'scatter3d.figure': ['ages', 'radio1', 'slider1'],
+    'choropleth.figure': ['ages', 'cods'],
+    'correlations.figure': ['ages', 'corr-method', 'corr-state'],
+}
+PERCENTILES = (50, 95, 99)
+
+
+def choro_pairs() -> list:
+    """(ages, cods) values the choropleth draws, e.g. there is no B_HIV."""
+    import app
+    return app.choro_grid()
+
+
+def options(values, name, pairs) -> list:
+    """Values of control `name` that keep (ages, cods) one of `pairs`."""
+    if name not in ('ages', 'cods'):
+        return CONTROLS[name]
+    kept = []
+    for value in CONTROLS[name]:
+        moved = dict(values, **{name: value})
+        if (moved['ages'], moved['cods']) in pairs:
+            kept.append(value)
+    return kept
+
+
+def session(rng, steps, pairs):
+    """
+    One user's traffic: lists of (output, request body), one list per step.
+    The first step loads the page, every later one moves one control.
+    Ages and cods only move between the `pairs` of `choro_pairs`.
+    """
+    values = dict(FIXED)
+    values.update({name: rng.choice(options) for name, options in CONTROLS.items()})
+    values['ages'], values['cods'] = rng.choice(pairs)
+    changed = list(values)
+    for _ in range(steps):
+        yield [(output, update_request(output, [(i, values[i]) for i in inputs]))
+               for output, inputs in OUTPUTS.items()
+               if any(name in inputs for name in changed)]
+        name = rng.choice(list(CONTROLS))
+        values[name] = rng.choice(options(values, name, pairs))
+        changed = [name]
+
+
+class ClientTarget():
+
+    def __init__(self):
+        """The app's Flask test client, in this process."""
+        import app
+        self.server = app.server
+        # failed requests are counted, their tracebacks would drown the report
+        self.server.logger.disabled = True
+
+    def connect(self):
+        client = self.server.test_client()
+        def post(body):
+            response = client.post(URL, json=body)
+            return response.status_code, len(response.data)
+        return post
+
+    def pids(self) -> list:
+        return [os.getpid()]
+
+    def close(self):
+        pass
+
+
+class GunicornTarget():
+
+    def __init__(self, workers, threads, timeout=120):
+        """
+        A local gunicorn with `workers` x `threads`, like the Procfile's, on
+        a free port of 127.0.0.1. Waits until it answers.
+        """
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        cmd = [sys.executable, '-m', 'gunicorn', 'app:server', '--preload',
+               '--config', 'gunicorn.conf.py',
+               '--workers', str(workers), '--threads', str(threads),
+               '--bind', '127.0.0.1:{}'.format(self.port), '--log-level', 'warning']
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        deadline = time.time() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn exited with {}, is it installed?'.format(
+                    self.process.returncode))
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                conn.request('GET', '/')
+                conn.getresponse().read()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    self.close()
+                    raise
+                time.sleep(0.2)
+
+    def connect(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'}
+        def post(body):
+            # a closed keep-alive connection is reopened by the next request
+            conn.request('POST', URL, json.dumps(body), headers)
+            response = conn.getresponse()
+            return response.status, len(response.read())
+        return post
+
+    def pids(self) -> list:
+        """The workers, the master only forks and supervises."""
+        master = self.process.pid
+        with open('/proc/{}/task/{}/children'.format(master, master)) as f:
+            return [int(pid) for pid in f.read().split()]
+
+    def close(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def user(target, seed, deadline, steps, think, warmup, records, pairs):
+    """Runs one virtual user, appending (output, start, seconds, status, bytes)."""
+    rng = random.Random(seed)
+    post = target.connect()
+    for i, requests in enumerate(session(rng, steps, pairs)):
+        if time.perf_counter() > deadline:
+            return
+        for output, body in requests:
+            start = time.perf_counter()
+            try:
+                status, size = post(body)
+            except (OSError, http.client.HTTPException):
+                status, size = 0, 0
+            if i >= warmup:
+                records.append((output, start, time.perf_counter() - start, status, size))
+        if think:
+            time.sleep(rng.expovariate(1000 / think))
+
+
+def summarize(records, seconds) -> dict:
+    """Latency percentiles in ms, throughput and errors of a run."""
+    def stats(rows):
+        ok = np.array([r[2] for r in rows if r[3] == 200]) * 1e3
+        result = {'requests': len(rows), 'errors': len(rows) - len(ok),
+                  'kb': sum(r[4] for r in rows) / len(rows) / 1024 if rows else 0}
+        for p in PERCENTILES:
+            result['p{}'.format(p)] = float(np.percentile(ok, p)) if len(ok) else None
+        return result
+    summary = stats(records)
+    summary['rps'] = len(records) / seconds
+    summary['outputs'] = {output: stats([r for r in records if r[0] == output])
+                          for output in OUTPUTS}
+    return summary
+
+
+def run(target, users=8, seconds=10.0, steps=1000, think=0.0, warmup=1, seed=0,
+        pairs=None) -> dict:
+    """
+    Drives `target` with `users` concurrent virtual users for `seconds`
+    (or `steps` steps per user). The first `warmup` steps of each user are
+    not counted. Returns the summary with the memory of the serving processes.
+    """
+    pairs = choro_pairs() if pairs is None else pairs
+    records = []
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(target, seed + i, start + seconds,
+                                                   steps, think, warmup, records, pairs))
+               for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # measured while the workers still hold what serving made them load
+    summary = summarize(records, time.perf_counter() - start)
+    summary['memory'] = [smaps_rollup(pid) for pid in target.pids()]
+    return summary
+
+
+def print_run(name, summary):
+    row = '{:<14} {:>8} {:>6} {:>8.1f} {:>8} {:>8} {:>8} {:>9} {:>9}'
+    ms = lambda v: '-' if v is None else '{:.1f}'.format(v)
+    memory = summary['memory']
+    print(row.format(name, summary['requests'], summary['errors'], summary['rps'],
+                     ms(summary['p50']), ms(summary['p95']), ms(summary['p99']),
+                     '{:.1f}'.format(sum(m['rss'] for m in memory) / len(memory)),
+                     '{:.1f}'.format(sum(m['pss'] for m in memory))))
+    for output, stats in summary['outputs'].items():
+        print(row.format('  ' + output.split('.')[0], stats['requests'], stats['errors'],
+                         stats['requests'] / summary['requests'] * summary['rps']
+                         if summary['requests'] else 0,
+                         ms(stats['p50']), ms(stats['p95']), ms(stats['p99']), '', ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--config', nargs='+', default=['1x1'],
+                        help='gunicorn WORKERSxTHREADS to compare, e.g. 2x1 4x1 2x4')
+    parser.add_argument('--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of a run')
+    parser.add_argument('--steps', type=int, default=1000,
+                        help='maximum control changes per user')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean think time between steps, ms')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='first steps of each user not counted')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    configs = args.config if args.target == 'gunicorn' else ['client']
+    print('{} users, {:g} s, think {:g} ms; latency in ms of successful requests, '
+          'memory in MB'.format(args.users, args.seconds, args.think))
+    print('{:<14} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}'.format(
+        'config', 'requests', 'errors', 'req/s', 'p50', 'p95', 'p99',
+        'rss/proc', 'total pss'))
+    pairs = choro_pairs()
+    results = {}
+    for config in configs:
+        if args.target == 'gunicorn':
+            workers, threads = (int(n) for n in config.split('x'))
+            target = GunicornTarget(workers, threads)
+        else:
+            target = ClientTarget()
+        try:
+            results[config] = run(target, args.users, args.seconds, args.steps,
+                                  args.think, args.warmup, args.seed, pairs)
+        finally:
+            target.close()
+        print_run(config, results[config])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Per worker memory of the Dash app with and without CHSI_SHARED_DATA.
+
+Mimics gunicorn: a master process imports app.py (with `--preload`, as the
+Procfile does) or leaves it to each worker, then forks the workers. Every
+worker reads all numeric data and draws a few figures, like it would while
+serving, and is measured from /proc/<pid>/smaps_rollup once all workers run:
+  rss     : resident memory, shared pages included
+  pss     : resident memory with shared pages split between their users
+  private : pages no other process uses, what each added worker costs
+Run from the repo root (Linux only) with ``python -m benchmarks.memory``.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+
+FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def smaps_rollup(pid='self') -> dict:
+    """Memory summary of a process in MB."""
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in FIELDS:
+                values[key] = int(rest.split()[0]) / 1024
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'private': values['Private_Clean'] + values['Private_Dirty']}
+
+
+def serve(app):
+    """Touches what a worker touches while answering requests."""
+    for frame in (app.snapshot.cod.df, app.snapshot.scatter.demogr):
+        for col in frame.columns:
+            values = frame[col].to_numpy()
+            if values.dtype.kind in 'biuf':
+                values.sum()
+    for age in 'ADF':
+        app.display_fig_dict(age, 1, 10)
+    app.plot_state_choro_dict('D', 'Homicide')
+
+
+def run_workers(workers, preload) -> list:
+    """Forks the workers and measures them while all of them are alive."""
+    if preload:
+        import app
+    children = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            if not preload:
+                import app
+            serve(app)
+            os.write(write, b'.')
+            while True:
+                signal.pause()
+        os.close(write)
+        children.append((pid, read))
+    for _, read in children:
+        os.read(read, 1)
+    results = [smaps_rollup(pid) for pid, _ in children]
+    for pid, _ in children:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    return results
+
+
+def measure(workers, preload, shared) -> list:
+    """run_workers in a fresh interpreter with CHSI_SHARED_DATA set or not."""
+    env = dict(os.environ)
+    env.pop('CHSI_SHARED_DATA', None)
+    if shared:
+        env['CHSI_SHARED_DATA'] = '1'
+    cmd = [sys.executable, '-m', 'benchmarks.memory', '--child', str(workers)]
+    if not preload:
+        cmd.append('--no-preload')
+    out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, universal_newlines=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--no-preload', dest='preload', action='store_false')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_workers(args.child, args.preload)))
+        return 0
+
+    print('MB per worker, preload {}'.format('on' if args.preload else 'off'))
+    print('{:<8} {:>7} {:>9} {:>9} {:>9} {:>11}'.format(
+        'shared', 'workers', 'rss', 'pss', 'private', 'total pss'))
+    for shared in (False, True):
+        for workers in args.workers:
+            results = measure(workers, args.preload, shared)
+            mean = {k: sum(r[k] for r in results) / workers for k in results[0]}
+            print('{:<8} {:>7} {:9.1f} {:9.1f} {:9.1f} {:11.1f}'.format(
+                'on' if shared else 'off', workers, mean['rss'], mean['pss'],
+                mean['private'], mean['pss'] * workers))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Startup profile of the Dash app, with and without CHSI_FAST_STARTUP.
+
+Every run starts a fresh interpreter, like a gunicorn worker that imports
+app.py itself, and measures from the moment it is spawned
+  import : until `import app` returns, when a worker starts accepting
+  ready  : until the page's first three figures are answered
+plus the startup phases and dataset loads the app times itself (see
+metrics.py). The runs are repeated and the medians reported. The import
+profile lists the self time of `python -X importtime -c "import app"` per
+top level package, with the app's own module level work under `app`.
+Run from the repo root (Linux only) with ``python -m benchmarks.startup``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+
+MODES = {'default': {}, 'fast': {'CHSI_FAST_STARTUP': '1'}}
+# the controls' initial values in the layout of app.py
+INITIAL = {'scatter3d.figure': [('ages', 'D'), ('radio1', 0), ('slider1', 0)],
+           'choropleth.figure': [('ages', 'D'), ('cods', 'Homicide')],
+           'correlations.figure': [('ages', 'D'), ('corr-method', 'pearson'),
+                                   ('corr-state', 0)]}
+
+
+def child(spawned):
+    """One worker's startup, `spawned` is the parent's perf_counter at spawn."""
+    import app
+    imported = time.perf_counter()
+    from benchmarks.figures import update_request
+    client = app.server.test_client()
+    status = [client.post('/_dash-update-component',
+                          json=update_request(output, inputs)).status_code
+              for output, inputs in INITIAL.items()]
+    ready = time.perf_counter()
+    ms = lambda timings: {name: s * 1e3 for name, s in timings.items()}
+    print(json.dumps({'import': (imported - spawned) * 1e3, 'ready': (ready - spawned) * 1e3,
+                      'status': status, 'phases': ms(app.metrics.phases),
+                      'loads': ms(app.metrics.loads)}))
+
+
+def run(env) -> dict:
+    """Startup timings of one fresh interpreter with `env` added."""
+    env = dict(os.environ, **env)
+    # perf_counter is CLOCK_MONOTONIC, the same clock in every process
+    spawned = time.perf_counter()
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-m', 'benchmarks.startup',
+                          '--child', repr(spawned)], env=env, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def median(runs) -> dict:
+    """Median of every timing over the runs."""
+    result = {key: float(np.median([r[key] for r in runs])) for key in ('import', 'ready')}
+    for key in ('phases', 'loads'):
+        names = [name for name in runs[0][key]]
+        result[key] = {name: float(np.median([r[key].get(name, np.nan) for r in runs]))
+                       for name in names}
+    result['errors'] = sum(s != 200 for r in runs for s in r['status'])
+    return result
+
+
+def import_profile(env=None) -> dict:
+    """{top level package: self ms} of `python -X importtime -c 'import app'`."""
+    env = dict(os.environ, **(env or {}))
+    err = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', 'import app'],
+                         env=env, check=True, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, universal_newlines=True).stderr
+    packages = defaultdict(float)
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1e3
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per mode')
+    parser.add_argument('--top', type=int, default=12, help='packages in the import profile')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child is not None:
+        child(args.child)
+        return 0
+
+    results = {mode: median([run(env) for _ in range(args.repeat)])
+               for mode, env in MODES.items()}
+    print('median of {} fresh interpreters, ms since spawn'.format(args.repeat))
+    print('{:<26} {:>9} {:>9}'.format('', *MODES))
+    for key in ('import', 'ready'):
+        print('{:<26} {:9.1f} {:9.1f}'.format(key, *(results[m][key] for m in MODES)))
+    print('{:<26} {:>9} {:>9}'.format('errors', *(results[m]['errors'] for m in MODES)))
+    print('startup phases, ms (in the loader thread for fast)')
+    for key in ('loads', 'phases'):
+        names = list(dict.fromkeys(n for m in MODES for n in results[m][key]))
+        for name in names:
+            print('  {:<24} {:9.1f} {:9.1f}'.format(
+                name, *(results[m][key].get(name, float('nan')) for m in MODES)))
+
+    profile = import_profile(MODES['fast'])
+    print('import profile, self ms per top level package ({:.0f} ms in all)'.format(
+        sum(profile.values())))
+    for name, ms in list(profile.items())[:args.top]:
+        print('  {:<24} {:9.1f}'.format(name, ms))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results, 'imports': profile}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
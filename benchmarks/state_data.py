@@ -0,0 +1,97 @@
+"""
+Compares the vectorized `Dataset.state_data` with the original per state
+loop from George's notebook. Checks both give the same frame, up to the
+last bit of a mean (tests/test_state_data.py does the same), and prints the
+timings. Run from the repo root with ``python -m benchmarks.state_data``.
+"""
+import numpy as np
+import pandas as pd
+import bottleneck as bn
+from data.dataset import Dataset
+from benchmarks import best_of
+
+
+def state_data_loop(df) -> pd.DataFrame:
+    """The original `Dataset.state_data`, kept as the reference output."""
+    CI_cols = [col for col in df.columns if 'CI_' in col]
+    df_clean = df.drop(df[CI_cols], axis=1)
+    # replace negative values with NaN
+    df_clean = df_clean.replace([-1,-1111,-1111.1,-2,-2222.2,-2222,-9999,-9989.9],
+                      [np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,
+                      np.nan])
+
+    death_data = []
+    # list of all causes of death
+    cause_lst = df_clean.columns[6:-1]
+    # list and sort all states
+    state_col = np.array(df_clean.CHSI_State_Name.value_counts().index)
+    state_col.sort()
+    # create mean value of all causes in all states
+    for state in state_col:
+        df_state = df_clean[df_clean['CHSI_State_Name']==state]
+        FIPS_Code = df_state.iloc[-1].State_FIPS_Code
+        state_abbr = df_state.iloc[-1].CHSI_State_Abbr
+        state_lst = [FIPS_Code, state, state_abbr]
+        cause_mean = []
+        for cause in cause_lst:
+            cause_mean.append(df_state[cause].mean())
+        state_lst.extend(cause_mean)
+        death_data.append(state_lst)
+
+    # create dataframe for mean % of causes of death in all states
+    chsi_cols = ['State_FIPS_Code','State_Name','State_Abbr']
+    chsi_cols.extend(cause_lst)
+    df_mean = pd.DataFrame(death_data, columns=chsi_cols)
+
+    comp_cols = [col for col in df_mean.columns if '_Comp' in col or
+         '_BirthDef' in col or '_Cancer' in col or '_HeartDis' in col]
+    df_drop = df_mean.drop(df_mean[comp_cols],axis=1)
+
+    group = df_drop.columns[3:]
+    # list and sort all states
+    state_col = np.array(df_drop.State_Name.value_counts().index)
+    state_col.sort()
+    age_groups = ['B_','C_','D_']
+    causes_lst = ['_Injury','_Homicide','_Suicide','_HIV']
+    # create causes of death data
+    death_data = []
+    # create mean value of all causes in all states
+    for state in state_col:
+      df_state = df_drop[df_drop['State_Name']==state]
+      FIPS_Code = df_state.iloc[0].State_FIPS_Code
+      state_abbr = df_state.iloc[0].State_Abbr
+      state_lst = [FIPS_Code, state, state_abbr]
+      cause_mean = []
+      for age in age_groups:
+        for cause in causes_lst:
+          cause_pct = []
+          i = 0
+          for sub in group:
+            if age in sub and cause in sub:
+              i += 1
+              cause_pct.append(df_state.iloc[0][sub])
+          if i > 0:
+            cause_mean.append(bn.nanmean(cause_pct))
+      state_lst.extend(cause_mean)
+      death_data.append(state_lst)
+
+    # create dataframe for mean % of causes of death in all states
+    chsi_cols = ['State_FIPS_Code','State_Name','State_Abbr','B_Injury','B_Homicide'
+                ,'C_Injury','C_Homicide','C_Suicide','D_Injury','D_Homicide'
+                ,'D_Suicide','D_HIV']
+    return pd.DataFrame(death_data,columns=chsi_cols)
+
+
+def main(filename='./data/LEADINGCAUSESOFDEATH.csv', repeat=5):
+    cod = Dataset(filename)
+    # equal up to the last bit of a mean, see Dataset.state_data
+    pd.testing.assert_frame_equal(cod.state_data(), state_data_loop(cod.df),
+                                  check_exact=False, rtol=1e-12, atol=0)
+    loop = best_of(lambda: state_data_loop(cod.df), repeat)
+    vectorized = best_of(cod.state_data, repeat)
+    print('state_data  loop {:8.2f} ms   vectorized {:8.2f} ms   x{:.0f}'.format(
+        loop * 1e3, vectorized * 1e3, loop / vectorized))
+
+
+if __name__ == '__main__':
+    main()
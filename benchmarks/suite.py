@@ -0,0 +1,236 @@
+"""
+Microbenchmark suite for Dataset and the figure builders, with baselines.
+
+Every case sweeps a function over its whole input grid and records the wall
+time per sweep, best of `--repeat` samples of at least MIN_SAMPLE seconds
+each, and the peak traced memory of a single sweep. Timings of the same
+code differ by up to ~70% between processes (memory layout, a shared VM's
+neighbours) but much less within one, so the suite runs in `--runs` fresh
+interpreters and keeps the best of each case; cases that still look slower
+than their baseline are timed again in up to `--confirm` more.
+Figure builders and callbacks are timed as a serving worker runs them, i.e.
+with their per process caches warm.
+
+  python -m benchmarks.suite --save     record this machine's baseline
+  python -m benchmarks.suite            compare against it, exit 1 when a
+                                        case got slower or bigger by more
+                                        than --threshold percent
+
+Wall times only compare on the machine they were measured on, so baselines
+are kept per host in benchmarks/baselines/<host>.json and are not checked
+in; record one before changing the code. CI runners are fresh machines, so
+a CI job records the baseline itself, on the base commit, in the same job
+that checks the change:
+
+  git checkout $BASE && python -m benchmarks.suite --save --baseline base.json
+  git checkout $HEAD && python -m benchmarks.suite --baseline base.json
+"""
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from benchmarks import best_of
+
+BASELINE = Path(__file__).parent / 'baselines' / '{}.json'.format(platform.node() or 'local')
+CAUSES_OF_DEATH = './data/LEADINGCAUSESOFDEATH.csv'
+RACES = ['Wh', 'Bl', 'Hi', 'Ot']
+# wall times and peaks below these are noise, they never count as regressions
+MIN_MS = 1.0
+MIN_KB = 64.0
+# fast sweeps are repeated within a sample until it takes this long, seconds
+MIN_SAMPLE = 0.2
+
+
+def sweep(func, grid):
+    """Calls func once for every argument tuple in grid."""
+    for args in grid:
+        func(*args)
+
+
+def sweep_ms(func, grid, repeat=5) -> float:
+    """Best wall time of one sweep in ms, sampled like `timeit.autorange`."""
+    start = time.perf_counter()
+    sweep(func, grid)
+    number = max(1, int(MIN_SAMPLE / (time.perf_counter() - start)))
+    def sample():
+        for _ in range(number):
+            sweep(func, grid)
+    return best_of(sample, repeat) / number * 1e3
+
+
+def peak_memory(func, grid) -> float:
+    """Peak memory traced during one sweep, in KB."""
+    tracemalloc.start()
+    try:
+        sweep(func, grid)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def cases():
+    """(name, function, argument grid) for every benchmark case."""
+    import app
+    from data.dataset import Dataset
+
+    ages = [o['value'] for o in app.ages_dropdown]
+    causes = [o['value'] for o in app.causes_dropdown]
+    triples = [(a, r, c) for a in ages for r in RACES for c in causes]
+    hover = app.snapshot.choro.hover
+    pairs = [(a, c) for a in ages for c in causes
+             if a+'_'+c in app.snapshot.choro.state_cod.columns]
+
+    raw = Dataset(CAUSES_OF_DEATH)
+    scratch = Dataset(CAUSES_OF_DEATH)
+    def preproc():
+        scratch.df = raw.df
+        scratch.preproc()
+    prep = Dataset(CAUSES_OF_DEATH)
+    prep.preproc()
+    slices = [prep.lookup(*t) for t in triples if prep.isin_cols(*t)]
+
+    scatter_grid = [(age, 0, 0) for age in ages]
+    sliced_grid = [(age, 1, r) for age in ages for r in range(app.SLICENUM)]
+    return [
+        ('Dataset.__init__', Dataset, [(CAUSES_OF_DEATH,)]),
+        ('Dataset.__init__[csv]', Dataset, [(CAUSES_OF_DEATH, False)]),
+        ('Dataset.preproc', preproc, [()]),
+        ('Dataset.lookup', prep.lookup, [t for t in triples if prep.isin_cols(*t)]),
+        ('Dataset.isin_cols', prep.isin_cols, triples),
+        ('Dataset.state_data', raw.state_data, [()]),
+        ('display_fig[all]', app.display_fig, scatter_grid),
+        ('display_fig[slice]', app.display_fig, sliced_grid),
+        ('plot_state_choro', lambda a, c: app.plot_state_choro(hover, a, c),
+         pairs),
+        ('plot_choropleth', app.plot_choropleth, [(s,) for s in slices]),
+        ('update_3dscatter', app.update_3dscatter, scatter_grid + sliced_grid),
+        ('update_choro', app.update_choro, pairs),
+    ]
+
+
+def run(patterns=('*',), repeat=5) -> dict:
+    """Runs the cases matching any of the glob patterns, {name: result}."""
+    results = {}
+    for name, func, grid in cases():
+        if not any(fnmatch.fnmatch(name, p) for p in patterns):
+            continue
+        sweep(func, grid)  # warm up per process caches
+        results[name] = {
+            'calls': len(grid),
+            'ms': sweep_ms(func, grid, repeat),
+            'peak_kb': peak_memory(func, grid),
+        }
+    return results
+
+
+def run_fresh(patterns, repeat) -> dict:
+    """`run` in a fresh interpreter."""
+    cmd = [sys.executable, '-W', 'ignore', '-m', 'benchmarks.suite', '--child',
+           '--repeat', str(repeat)]
+    for pattern in patterns:
+        cmd += ['-k', pattern]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True, cwd=os.getcwd()).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def best(results, more) -> dict:
+    """Per case best time and peak of two {name: result} dicts."""
+    merged = dict(results)
+    for name, r in more.items():
+        base = merged.get(name)
+        merged[name] = r if base is None else dict(
+            base, ms=min(base['ms'], r['ms']), peak_kb=min(base['peak_kb'], r['peak_kb']))
+    return merged
+
+
+def compare(results, baseline, threshold) -> list:
+    """Names of the cases that regressed beyond threshold percent."""
+    limit = 1 + threshold / 100
+    failed = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slower = result['ms'] > max(base['ms'], MIN_MS) * limit
+        bigger = result['peak_kb'] > max(base['peak_kb'], MIN_KB) * limit
+        if slower or bigger:
+            failed.append(name)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='record the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=25.0,
+                        help='allowed regression in percent')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='samples per case and interpreter')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='fresh interpreters, the best result of each case counts')
+    parser.add_argument('--confirm', type=int, default=2,
+                        help='more interpreters for cases that look regressed')
+    parser.add_argument('-k', dest='patterns', action='append',
+                        help='only run cases matching this glob, repeatable')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    patterns = args.patterns or ['*']
+    if args.child:
+        print(json.dumps(run(patterns, args.repeat)))
+        return 0
+
+    baseline = {}
+    if args.baseline.exists() and not args.save:
+        with open(args.baseline) as f:
+            recorded = json.load(f)
+        baseline = recorded['cases']
+        print('baseline recorded {} on {}'.format(recorded['recorded'], recorded['host']))
+    elif not args.save:
+        print('no baseline at {}, record one with --save'.format(args.baseline))
+    results = {}
+    for _ in range(args.runs):
+        results = best(results, run_fresh(patterns, args.repeat))
+    for _ in range(args.confirm):
+        failed = compare(results, baseline, args.threshold)
+        if not failed:
+            break
+        results = best(results, run_fresh([glob.escape(n) for n in failed], args.repeat))
+    failed = compare(results, baseline, args.threshold)
+
+    print('{:<24} {:>6} {:>10} {:>8} {:>11} {:>8}'.format(
+        'case', 'calls', 'ms', 'vs base', 'peak KB', 'vs base'))
+    for name, r in results.items():
+        base = baseline.get(name)
+        change = lambda key: '{:+7.1f}%'.format(
+            (r[key] / base[key] - 1) * 100) if base and base[key] else ''
+        print('{:<24} {:6d} {:10.2f} {:>8} {:11.1f} {:>8}  {}'.format(
+            name, r['calls'], r['ms'], change('ms'), r['peak_kb'],
+            change('peak_kb'), 'REGRESSED' if name in failed else ''))
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({'recorded': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'host': platform.node(),
+                       'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'cases': results}, f, indent=1)
+        print('saved', args.baseline)
+    elif failed:
+        print('{} case(s) regressed by more than {:g}%'.format(
+            len(failed), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+"""
+pytest setup. Living at the repo root puts the root on sys.path, and every
+test runs from there, since the app and the datasets read ./data.
+"""
+import os
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def repo_root():
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    yield ROOT
+    os.chdir(cwd)
@@ -0,0 +1,286 @@
+"""On-disk columnar cache for CHSI csv files.
+
+Parsing the CHSI csv files is the slowest part of booting the app, and every
+gunicorn worker repeats it. This module parses a csv once, stores the columns
+as .npy files next to a small json manifest, and afterwards reads the raw
+column buffers back instead of parsing text. Numeric columns of one dtype
+share a plain 2-D .npy file, one column per row, which is the layout pandas
+keeps internally. The files can therefore also be memory mapped straight into
+a DataFrame (`ColumnarCache.load(mmap=True)`): every process that opens the
+cache then reads the same page cache pages instead of holding its own copy.
+
+The cache is keyed on the source file's size, mtime and sha1 hash, and is
+rebuilt automatically whenever any of them changes.
+
+Run ``python -m data.cache`` to compare csv and cache load times.
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 2
+MANIFEST = 'manifest.json'
+# numpy kinds that are written as-is and can be memory mapped directly
+NUMERIC_KINDS = 'biuf'
+
+
+def default_cache_dir(filename) -> Path:
+    """Cache root for a csv file, a hidden folder next to the csv."""
+    return Path(filename).parent / '.cache'
+
+
+def file_hash(filename, chunksize=1 << 20) -> str:
+    """sha1 hex digest of a file, read in chunks."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def source_signature(filename, with_hash=True) -> dict:
+    """Size, mtime and (optionally) sha1 of the source csv."""
+    stat = os.stat(filename)
+    sig = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        sig['sha1'] = file_hash(filename)
+    return sig
+
+
+def is_numeric(dtype) -> bool:
+    """True for dtype names that are stored as plain numpy arrays."""
+    try:
+        return np.dtype(dtype).kind in NUMERIC_KINDS
+    except TypeError:
+        return False
+
+
+class ColumnarCache():
+
+    def __init__(self, filename, cache_dir=None):
+        """
+        Columnar cache of a single csv file, stored in `<cache_dir>/<csv stem>`
+        and described by `manifest.json`.
+
+        Numeric columns are saved with their pandas dtype, all columns of one
+        dtype as the rows of a single `<dtype>.npy` block. Text columns are
+        saved one per file, `cNNNN.npy`, as fixed width unicode arrays plus a
+        boolean null mask.
+
+        Parameters
+        ----------
+        filename : csv filename that contains CHSI data
+        cache_dir : cache root folder, defaults to `.cache` next to the csv
+        """
+        self.filename = Path(filename)
+        cache_dir = default_cache_dir(filename) if cache_dir is None else cache_dir
+        self.path = Path(cache_dir) / self.filename.stem
+
+    def manifest(self):
+        """Returns the parsed manifest, or None if there is no usable cache."""
+        try:
+            with open(self.path / MANIFEST) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != CACHE_VERSION:
+            return None
+        return manifest
+
+    def is_fresh(self, manifest=None) -> bool:
+        """
+        Compares the manifest against the source csv. Size and mtime are
+        checked first since they are free, then the content hash.
+        """
+        manifest = self.manifest() if manifest is None else manifest
+        if manifest is None:
+            return False
+        source = manifest['source']
+        sig = source_signature(self.filename, with_hash=False)
+        if sig['size'] != source['size'] or sig['mtime_ns'] != source['mtime_ns']:
+            return False
+        return file_hash(self.filename) == source['sha1']
+
+    def build(self, df=None) -> dict:
+        """
+        Parses the csv (unless `df` is given) and writes the cache. Columns are
+        written into a temporary folder that is swapped in with a rename, so
+        concurrent readers never see a half written cache.
+        """
+        sig = source_signature(self.filename)
+        if df is None:
+            df = pd.read_csv(self.filename)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.parent / '.{}.{}.tmp'.format(self.path.name, os.getpid())
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir()
+
+        columns, blocks = [], {}
+        for i, col in enumerate(df.columns):
+            series = df[col]
+            entry = {'name': col, 'dtype': str(series.dtype)}
+            if is_numeric(series.dtype):
+                block = blocks.setdefault(entry['dtype'], [])
+                entry['file'] = '{}.npy'.format(entry['dtype'])
+                entry['row'] = len(block)
+                block.append(series.to_numpy())
+            else:
+                entry['file'] = 'c{:04d}.npy'.format(i)
+                mask = series.isna().to_numpy()
+                values = series.to_numpy(dtype=object).copy()
+                values[mask] = ''
+                np.save(tmp / entry['file'], values.astype(str))
+                if mask.any():
+                    entry['mask'] = 'm{:04d}.npy'.format(i)
+                    np.save(tmp / entry['mask'], mask)
+            columns.append(entry)
+        for dtype, block in blocks.items():
+            np.save(tmp / '{}.npy'.format(dtype), np.stack(block))
+
+        manifest = {'version': CACHE_VERSION, 'source': sig,
+                    'nrows': len(df), 'columns': columns}
+        with open(tmp / MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+        old = self.path.parent / '.{}.{}.old'.format(self.path.name, os.getpid())
+        if self.path.exists():
+            os.replace(self.path, old)
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            # another process won the race and already swapped its cache in
+            shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+        return manifest
+
+    def columns(self, manifest=None, mmap_mode='r') -> dict:
+        """
+        Opens the cached columns as {name: array}. Numeric columns are read
+        only memory maps; text columns are object arrays with NaN for nulls.
+        """
+        manifest = self.manifest() if manifest is None else manifest
+        arrays, blocks = {}, {}
+        for entry in manifest['columns']:
+            if is_numeric(entry['dtype']):
+                if entry['file'] not in blocks:
+                    blocks[entry['file']] = np.load(self.path / entry['file'],
+                                                    mmap_mode=mmap_mode)
+                arrays[entry['name']] = blocks[entry['file']][entry['row']]
+            else:
+                values = np.load(self.path / entry['file']).astype(object)
+                if 'mask' in entry:
+                    values[np.load(self.path / entry['mask'])] = np.nan
+                arrays[entry['name']] = values
+        return arrays
+
+    def load(self, mmap=False) -> pd.DataFrame:
+        """
+        Returns the cached csv as a DataFrame, rebuilding the cache first if
+        it is missing or stale. Gives the same frame as `pd.read_csv`.
+
+        Numeric columns of the same dtype are read straight into one 2-D
+        block, which is what pandas stores internally, so building the frame
+        does not copy or consolidate hundreds of separate arrays.
+
+        With `mmap` the blocks are read only memory maps of the cache files
+        instead. Their pages live in the OS page cache and are shared by all
+        processes mapping the same files, e.g. forked gunicorn workers, and
+        never turn into private copies since nothing can write to them.
+        """
+        manifest = self.manifest()
+        if not self.is_fresh(manifest):
+            manifest = self.build()
+        try:
+            return self.frame(manifest, mmap)
+        except ValueError:
+            # files that do not match the manifest, e.g. a cache folder
+            # edited by hand, are rebuilt like a stale cache
+            return self.frame(self.build(), mmap)
+
+    def frame(self, manifest, mmap=False) -> pd.DataFrame:
+        """
+        The DataFrame of a manifest's files, see `load`. Raises ValueError
+        when a file does not hold the manifest's number of rows.
+        """
+        nrows = manifest['nrows']
+
+        groups = {}
+        for entry in manifest['columns']:
+            key = entry['dtype'] if is_numeric(entry['dtype']) else None
+            groups.setdefault(key, []).append(entry)
+
+        frames = []
+        for dtype, entries in groups.items():
+            if dtype is None:
+                arrays = self.columns({'columns': entries})
+                if any(len(values) != nrows for values in arrays.values()):
+                    raise ValueError('text columns of {} do not have {} rows'.format(
+                        self.path, nrows))
+                frames.append(pd.DataFrame({e['name']: pd.Series(arrays[e['name']],
+                                                                 dtype=e['dtype'])
+                                            for e in entries}))
+                continue
+            block = np.load(self.path / entries[0]['file'],
+                            mmap_mode='r' if mmap else None)
+            if block.shape != (len(entries), nrows):
+                raise ValueError('{} block of {} is {}, expected {}'.format(
+                    dtype, self.path, block.shape, (len(entries), nrows)))
+            frames.append(pd.DataFrame(block.T, columns=[e['name'] for e in entries],
+                                       copy=False))
+
+        names = [e['name'] for e in manifest['columns']]
+        df = pd.concat(frames, axis=1) if len(frames) > 1 else frames[0]
+        return df[names] if list(df.columns) != names else df
+
+
+def read_csv(filename, cache=True, cache_dir=None, mmap=False) -> pd.DataFrame:
+    """
+    Drop-in for `pd.read_csv(filename)` that goes through the columnar cache.
+    Falls back to parsing the csv if the cache folder is not writable.
+    `mmap` maps the numeric columns read only, see `ColumnarCache.load`.
+    """
+    if not cache:
+        return pd.read_csv(filename)
+    try:
+        return ColumnarCache(filename, cache_dir).load(mmap=mmap)
+    except OSError:
+        return pd.read_csv(filename)
+
+
+def benchmark(filenames, repeat=5):
+    """
+    Times `pd.read_csv` against `read_csv` through a warm cache and checks
+    both paths give the same frame. Returns a list of result dicts.
+    """
+    results = []
+    for filename in filenames:
+        ColumnarCache(filename).load()  # make sure the cache is warm
+        csv_times, cache_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            expected = pd.read_csv(filename)
+            csv_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cached = read_csv(filename)
+            cache_times.append(time.perf_counter() - start)
+        pd.testing.assert_frame_equal(expected, cached)
+        results.append({'file': str(filename), 'csv': min(csv_times),
+                        'cache': min(cache_times)})
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    files = sys.argv[1:] or ['./data/LEADINGCAUSESOFDEATH.csv',
+                             './data/DEMOGRAPHICS.csv']
+    for r in benchmark(files):
+        print('{:<40} csv {:8.2f} ms   cache {:8.2f} ms   x{:.1f}'.format(
+            Path(r['file']).name, r['csv'] * 1e3, r['cache'] * 1e3,
+            r['csv'] / r['cache']))
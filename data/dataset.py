@@ -2,11 +2,20 @@
 from pathlib import Path
 import pandas as pd
 import numpy as np
-import bottleneck as bn
+from data.cache import read_csv
+from data.index import ColumnIndex, FipsIndex, fips_codes
+from data.tensor import Tensor
+
+# invalid values according to DEFINEDDATAVALUE.csv
+SENTINELS = [-1, -1111, -1111.1, -2, -2222.2, -2222, -9999, -9989.9]
+# age groups and causes shown on the state map
+AGE_GROUPS = ['B_', 'C_', 'D_']
+CAUSES = ['_Injury', '_Homicide', '_Suicide', '_HIV']
+DROPPED_CAUSES = ['_Comp', '_BirthDef', '_Cancer', '_HeartDis']
 
 class Dataset():
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, cache=True, mmap=False):
         """
         pandas Dataframe with methods to extract certain column features
         from CHSI datasets. Inits with self loading csv. Also contains
@@ -15,9 +24,41 @@ class Dataset():
         Parameters
         ----------
         filename : csv filename that contains CHSI data
+        cache : load through the columnar cache in data/.cache instead of
+                parsing the csv every time (see data/cache.py)
+        mmap : with the cache, keep the numeric columns as read only memory
+               maps of the cache files, shared by every process that loads
+               the same file
         """
-        self.df = pd.read_csv(filename)
+        self.df = read_csv(filename, cache=cache, mmap=mmap)
         self.filename = filename
+        self._indexes = {}
+
+    def _index(self, kind, build):
+        """Index of the current df, rebuilt when df was replaced."""
+        df, index = self._indexes.get(kind, (None, None))
+        if df is not self.df or index is None:
+            index = build(self.df)
+            self._indexes[kind] = (self.df, index)
+        return index
+
+    @property
+    def column_index(self) -> ColumnIndex:
+        """(age, race, cause) keys of the columns, see data/index.py"""
+        return self._index('columns', lambda df: ColumnIndex(df.columns))
+
+    @property
+    def fips_index(self) -> FipsIndex:
+        """Row positions by FIPS code, see data/index.py"""
+        return self._index('fips', lambda df: FipsIndex(fips_codes(df)))
+
+    @property
+    def tensor(self) -> Tensor:
+        """
+        The (age, race, cause) columns as one float32 county x age x race x
+        cause array, invalid values NaN, see data/tensor.py
+        """
+        return self._index('tensor', lambda df: Tensor.from_dataset(self, SENTINELS))
 
     def preproc(self):
         """
@@ -26,17 +67,25 @@ class Dataset():
         np.nan according to DEFINEDDATAVALUE.csv. Also constructs the five digit
         FIPS code from State_FIPS_Code and County_FIPS_Code.
 
-        TODO: plotly throws unrecognized FIPS value [2280]. Can't seem to find
-        that exact value looking at df.FIPS.
+        NOTE: FIPS 02280 (Wrangell-Petersburg, AK, split up in 2008) has no
+        county outline in plotly's shapefiles; CountyGeometry.report in
+        data/geometry.py lists such codes when a county map is drawn.
         """
         cols = self.df.columns.values
         cols_drop = [c for c in cols if 'CI_' in c]
-        self.df = self.df.drop(self.df[cols_drop], axis=1)
-        self.df = self.df.replace([-1,-1111,-1111.1,-2,-2222.2,-2222,-9999,-9989.9],
-                      [np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan])
+        self.df = self.df.drop(columns=cols_drop)
 
-        self.df.State_FIPS_Code = self.df.State_FIPS_Code.apply(lambda x:str(int(x)).zfill(2))
-        self.df.County_FIPS_Code = self.df.County_FIPS_Code.apply(lambda x:str(int(x)).zfill(3))
+        # one vectorized pass over the numeric columns; only the columns
+        # that hold a sentinel become float, like with df.replace
+        numeric = self.df.select_dtypes('number').columns
+        values = self.df[numeric].to_numpy(dtype=np.float64)
+        invalid = np.isin(values, SENTINELS)
+        hit = invalid.any(axis=0)
+        if hit.any():
+            self.df[numeric[hit]] = np.where(invalid[:, hit], np.nan, values[:, hit])
+
+        self.df.State_FIPS_Code = self.df.State_FIPS_Code.astype(np.int64).astype(str).str.zfill(2)
+        self.df.County_FIPS_Code = self.df.County_FIPS_Code.astype(np.int64).astype(str).str.zfill(3)
 
         self.df['FIPS'] = self.df.State_FIPS_Code + self.df.County_FIPS_Code
         #print(self.df[self.df['FIPS'].str.contains("2280")])
@@ -56,87 +105,146 @@ class Dataset():
         flags if the age, race, cod combination exists in the dataframe.
         """
         feature_col = str(age)+'_'+str(race)+'_'+str(cod)
-        cols = self.df.columns.values
-        return feature_col in cols
+        return feature_col in self.column_index
 
-    def state_data(self) -> pd.DataFrame:
+    def state_means(self, states=None) -> pd.DataFrame:
         """
-        Extracting State data for injury, homicide for all ethnicities.
-        Adopted from George's Notebook.
+        Mean of every cause column over the counties of each state, invalid
+        values skipped, states sorted by name. Adopted from
+        CHSI_LEADINGCAUSESOFDEATH_MEAN.ipynb.
+
+        Counties are sorted by state once and the per state means are a
+        single np.add.reduceat over the sorted rows.
+
+        Parameters
+        ----------
+        states : optional state names, only these states are computed
 
         NOTE: Has to be called w/o preproc()
         """
-        CI_cols = [col for col in self.df.columns if 'CI_' in col]
-        df_clean = self.df.drop(self.df[CI_cols],axis=1)
+        df = self.df
+        if states is not None:
+            df = df[df['CHSI_State_Name'].isin(list(states))]
+        # list of all causes of death (the last column is LCD_Time_Span)
+        cols = [col for col in df.columns if 'CI_' not in col]
+        cause_lst = cols[6:-1]
+        values = df[cause_lst].to_numpy(dtype=np.float64)
         # replace negative values with NaN
-        df_clean = df_clean.replace([-1,-1111,-1111.1,-2,-2222.2,-2222,-9999,-9989.9],
-                          [np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,np.nan,
-                          np.nan])
-
-        death_data = []
-        # list of all causes of death
-        cause_lst = df_clean.columns[6:-1]
-        # list and sort all states
-        state_col = np.array(df_clean.CHSI_State_Name.value_counts().index)
-        state_col.sort()
-        # create mean value of all causes in all states
-        for state in state_col:
-            df_state = df_clean[df_clean['CHSI_State_Name']==state]
-            FIPS_Code = df_state.iloc[-1].State_FIPS_Code
-            state_abbr = df_state.iloc[-1].CHSI_State_Abbr
-            state_lst = [FIPS_Code, state, state_abbr]
-            cause_mean = []
-            for cause in cause_lst:
-                cause_mean.append(df_state[cause].mean())
-            state_lst.extend(cause_mean)
-            death_data.append(state_lst)
-
-        # create dataframe for mean % of causes of death in all states
-        chsi_cols = ['State_FIPS_Code','State_Name','State_Abbr']
-        chsi_cols.extend(cause_lst)
-        df_mean = pd.DataFrame(death_data, columns=chsi_cols)
-
-        comp_cols = [col for col in df_mean.columns if '_Comp' in col or
-             '_BirthDef' in col or '_Cancer' in col or '_HeartDis' in col]
-        df_drop = df_mean.drop(df_mean[comp_cols],axis=1)
-        #print(df_drop.columns)
-        #print(df_drop.head(5))
-
-        group = df_drop.columns[3:]
-        # list and sort all states
-        state_col = np.array(df_drop.State_Name.value_counts().index)
-        state_col.sort()
-        age_groups = ['B_','C_','D_']
-        causes_lst = ['_Injury','_Homicide','_Suicide','_HIV']
-        # create causes of death data
-        death_data = []
-        # create mean value of all causes in all states
-        for state in state_col:
-          df_state = df_drop[df_drop['State_Name']==state]
-          FIPS_Code = df_state.iloc[0].State_FIPS_Code
-          state_abbr = df_state.iloc[0].State_Abbr
-          state_lst = [FIPS_Code, state, state_abbr]
-          cause_mean = []
-          for age in age_groups:
-            for cause in causes_lst:
-              cause_pct = []
-              i = 0
-              for sub in group:
-                if age in sub and cause in sub:
-                  i += 1
-                  cause_pct.append(df_state.iloc[0][sub])
-              if i > 0:
-                cause_mean.append(bn.nanmean(cause_pct))
-          state_lst.extend(cause_mean)
-          death_data.append(state_lst)
-
-        #print(len(death_data))
-        # create dataframe for mean % of causes of death in all states
-        chsi_cols = ['State_FIPS_Code','State_Name','State_Abbr','B_Injury','B_Homicide'
-                    ,'C_Injury','C_Homicide','C_Suicide','D_Injury','D_Homicide'
-                    ,'D_Suicide','D_HIV']
-        df = pd.DataFrame(death_data,columns=chsi_cols)
-        #print(df.shape)
-        #df
-        #feature_col = str(age)+'_'+str(race)+'_'+str(cod)
-        return df
+        values = np.where(np.isin(values, SENTINELS), np.nan, values)
+
+        states = df['CHSI_State_Name'].to_numpy()
+        order = np.argsort(states, kind='stable')
+        states = states[order]
+        starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+        last = np.r_[starts[1:], len(states)] - 1
+        cause_mean = grouped_nanmean(values[order], starts)
+
+        data = {
+            'State_FIPS_Code': df['State_FIPS_Code'].to_numpy()[order][last],
+            'State_Name': states[starts],
+            'State_Abbr': df['CHSI_State_Abbr'].to_numpy()[order][last],
+        }
+        data.update(zip(cause_lst, cause_mean.T))
+        return pd.DataFrame(data)
+
+    def state_data(self, states=None) -> pd.DataFrame:
+        """
+        Extracting State data for injury, homicide for all ethnicities.
+        Adopted from George's Notebook. See state_table.
+
+        The means are summed in a different order than the notebook's per
+        state loop, so they equal its output only up to the last bit
+        (relative differences below 1e-15), see tests/test_state_data.py.
+
+        Parameters
+        ----------
+        states : optional state names, only these states are computed
+
+        NOTE: Has to be called w/o preproc()
+        """
+        return state_table(self.state_means(states))
+
+    def update_state_data(self, previous, states) -> pd.DataFrame:
+        """
+        `previous` state_data output with the rows of `states` recomputed
+        from this dataset, for a reload that only touched a few states.
+        Gives the frame state_data() gives on the whole dataset, up to the
+        last bit of a mean: BLAS may round a product of a few rows
+        differently than one of all states.
+        """
+        fresh = self.state_data(states)
+        keep = previous[~previous['State_Name'].isin(list(states))]
+        df = pd.concat([keep, fresh], ignore_index=True)
+        order = np.argsort(df['State_Name'].to_numpy(), kind='stable')
+        return df.iloc[order].reset_index(drop=True)
+
+
+def changed_states(old, new):
+    """
+    Names of the states with a county row that differs between two versions
+    of the same raw CHSI frame, rows matched by FIPS code. Numbers compare
+    by value, so a column read as int64 once and float64 the next time, say
+    after a blank cell, only flags the rows whose values changed. Returns
+    None when the columns differ and nothing can be reused.
+    """
+    if list(old.columns) != list(new.columns):
+        return None
+    hashes = []
+    for df in (old, new):
+        fips = fips_codes(df)
+        numeric = df.select_dtypes('number').columns
+        df = df.astype(dict.fromkeys(numeric, np.float64))
+        rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        hashes.append(pd.Series(rows, index=fips))
+    old_rows, new_rows = hashes
+    if not (old_rows.index.is_unique and new_rows.index.is_unique):
+        return None
+    fips = old_rows.index.union(new_rows.index)
+    diff = fips[old_rows.reindex(fips).to_numpy() != new_rows.reindex(fips).to_numpy()]
+    names = set()
+    for df in (old, new):
+        names.update(df['CHSI_State_Name'].to_numpy()[np.isin(fips_codes(df), diff)])
+    return names
+
+
+def state_table(means) -> pd.DataFrame:
+    """
+    State data for injury, homicide for all ethnicities from the state
+    means of Dataset.state_means: each age/cause output is a masked mean
+    over the matching race columns, done for all outputs at once.
+    """
+    cause_lst = means.columns[3:]
+    # row major like the grouped means, so the sums below add in the same order
+    cause_mean = np.ascontiguousarray(means[cause_lst].to_numpy(dtype=np.float64))
+
+    # race columns that make up each age group/cause pair
+    masks, names = [], []
+    for age in AGE_GROUPS:
+        for cause in CAUSES:
+            mask = [age in sub and cause in sub and not
+                    any(c in sub for c in DROPPED_CAUSES) for sub in cause_lst]
+            if any(mask):
+                masks.append(mask)
+                names.append(age + cause[1:])
+    masks = np.array(masks, dtype=np.float64).T
+
+    valid = ~np.isnan(cause_mean)
+    total = np.where(valid, cause_mean, 0) @ masks
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pct = total / (valid @ masks)
+
+    data = {col: means[col].to_numpy() for col in means.columns[:3]}
+    data.update(zip(names, pct.T))
+    return pd.DataFrame(data)
+
+
+def grouped_nanmean(values, starts) -> np.ndarray:
+    """
+    NaN skipping column means of consecutive row groups of a 2-D array, the
+    groups starting at the row positions in `starts`. All NaN groups give NaN.
+    """
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0, dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
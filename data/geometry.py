@@ -0,0 +1,205 @@
+"""Cached county outlines for county level choropleths.
+
+`ff.create_choropleth` reads the plotly-geo shapefiles with geopandas and
+rebuilds every county polygon on each call, which takes seconds. Here the
+outlines are extracted once, simplified for a few zoom levels and written to
+one .npz file per state and level under data/.cache/geometry. Drawing a map
+afterwards only slices flat lon/lat arrays.
+
+Run ``python -m data.geometry`` to build the cache ahead of time; otherwise
+it is built on first use. Building needs geopandas, shapely, pyshp and
+plotly-geo, loading only needs numpy.
+"""
+from pathlib import Path
+import json
+import os
+import threading
+import warnings
+import numpy as np
+
+GEOMETRY_VERSION = 1
+# simplification tolerance in degrees per zoom level, 0 is full detail
+LEVELS = (0.0, 0.005, 0.02, 0.05)
+
+
+def county_shapes():
+    """
+    County GeoDataFrame with FIPS, COUNTY_NAME and geometry columns, the
+    same county set `ff.create_choropleth` uses, including the pre-2010
+    Alaska areas it patches in.
+    """
+    from plotly.figure_factory import _county_choropleth as cc
+    gdf, _ = cc._create_us_counties_df(cc.st_to_state_name_dict,
+                                       cc.state_to_st_dict)
+    return gdf
+
+
+def outline(geometry):
+    """Exterior rings of a (multi)polygon as lon/lat arrays, NaN separated."""
+    parts = getattr(geometry, 'geoms', [geometry])
+    coords = []
+    for part in parts:
+        coords.append(np.asarray(part.exterior.coords))
+        coords.append(np.full((1, 2), np.nan))
+    coords = np.concatenate(coords)
+    return coords[:, 0], coords[:, 1]
+
+
+class CountyGeometry():
+
+    def __init__(self, cache_dir='./data/.cache/geometry'):
+        """
+        County outlines indexed by state FIPS, read lazily from the on disk
+        cache. Per state and zoom level the cache holds, sorted by FIPS:
+        fips, county names, centroids, and flat lon/lat outline arrays with
+        `offsets` marking where each county starts.
+
+        Parameters
+        ----------
+        cache_dir : folder holding the manifest and the per state .npz files
+        """
+        self.path = Path(cache_dir)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._manifest = None
+
+    @property
+    def manifest(self) -> dict:
+        """Cache manifest, building the cache if it is missing or outdated."""
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    try:
+                        with open(self.path / 'manifest.json') as f:
+                            manifest = json.load(f)
+                    except (OSError, ValueError):
+                        manifest = None
+                    if manifest is None or manifest.get('version') != GEOMETRY_VERSION:
+                        manifest = self.build()
+                    self._manifest = manifest
+        return self._manifest
+
+    def build(self) -> dict:
+        """Extracts, simplifies and writes the outlines of every county."""
+        gdf = county_shapes().sort_values('FIPS')
+        gdf['state'] = gdf['FIPS'] // 1000
+        states = {}
+        for level, tolerance in enumerate(LEVELS):
+            folder = self.path / str(level)
+            folder.mkdir(parents=True, exist_ok=True)
+            for state, counties in gdf.groupby('state'):
+                geoms = counties.geometry
+                if tolerance:
+                    geoms = geoms.simplify(tolerance, preserve_topology=True)
+                lons, lats, offsets = [], [], [0]
+                for geom in geoms:
+                    lon, lat = outline(geom)
+                    lons.append(lon)
+                    lats.append(lat)
+                    offsets.append(offsets[-1] + len(lon))
+                centroids = counties.geometry.representative_point()
+                np.savez(folder / '{:02d}.npz'.format(state),
+                         fips=counties['FIPS'].to_numpy(dtype=np.int64),
+                         name=counties['COUNTY_NAME'].to_numpy(dtype=str),
+                         clon=centroids.x.to_numpy(dtype=np.float32),
+                         clat=centroids.y.to_numpy(dtype=np.float32),
+                         offsets=np.array(offsets, dtype=np.int64),
+                         lon=np.concatenate(lons).astype(np.float32),
+                         lat=np.concatenate(lats).astype(np.float32))
+                states['{:02d}'.format(state)] = len(counties)
+        manifest = {'version': GEOMETRY_VERSION, 'levels': list(LEVELS),
+                    'states': states}
+        # written last and swapped in whole, so a reader never sees a
+        # manifest of outlines that are not all written yet
+        tmp = self.path / '.manifest.json.{}.tmp'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.path / 'manifest.json')
+        return manifest
+
+    def state(self, state, level=0) -> dict:
+        """Cached arrays of one state (FIPS int) at one zoom level."""
+        key = (int(state), level)
+        arrays = self._states.get(key)
+        if arrays is None:
+            if '{:02d}'.format(key[0]) not in self.manifest['states']:
+                arrays = None
+            else:
+                filename = self.path / str(level) / '{:02d}.npz'.format(key[0])
+                with np.load(filename) as npz:
+                    arrays = {k: npz[k] for k in npz.files}
+            self._states[key] = arrays
+        return arrays
+
+    def locate(self, fips, level=0):
+        """
+        Splits FIPS codes by state and finds their rows in the state arrays.
+        Yields (state arrays, positions in `fips`, rows in the state arrays)
+        for matched counties only.
+        """
+        fips = np.asarray(fips, dtype=np.int64)
+        states = fips // 1000
+        for state in np.unique(states):
+            arrays = self.state(state, level)
+            if arrays is None:
+                continue
+            where = np.flatnonzero(states == state)
+            rows = np.searchsorted(arrays['fips'], fips[where])
+            rows = np.minimum(rows, len(arrays['fips']) - 1)
+            found = arrays['fips'][rows] == fips[where]
+            yield arrays, where[found], rows[found]
+
+    def unmatched(self, fips) -> list:
+        """FIPS codes that have no outline in the cache."""
+        fips = np.asarray(fips, dtype=np.int64)
+        found = np.zeros(len(fips), dtype=bool)
+        for _, where, _ in self.locate(fips):
+            found[where] = True
+        return sorted(set(fips[~found].tolist()))
+
+    def outlines(self, fips, level=0):
+        """
+        Concatenated lon/lat outlines of the given counties, NaN separated,
+        ready for one filled Scattergeo trace.
+        """
+        lons, lats = [], []
+        for arrays, _, rows in self.locate(fips, level):
+            offsets = arrays['offsets']
+            for row in rows:
+                lons.append(arrays['lon'][offsets[row]:offsets[row + 1]])
+                lats.append(arrays['lat'][offsets[row]:offsets[row + 1]])
+        if not lons:
+            return np.empty(0, np.float32), np.empty(0, np.float32)
+        return np.concatenate(lons), np.concatenate(lats)
+
+    def centroids(self, fips):
+        """
+        Centroid lon/lat and county name for each FIPS code, in input order.
+        Unmatched counties get NaN coordinates and an empty name.
+        """
+        n = len(fips)
+        clon, clat = np.full(n, np.nan, np.float32), np.full(n, np.nan, np.float32)
+        names = np.full(n, '', dtype=object)
+        for arrays, where, rows in self.locate(fips):
+            clon[where] = arrays['clon'][rows]
+            clat[where] = arrays['clat'][rows]
+            names[where] = arrays['name'][rows]
+        return clon, clat, names
+
+    def report(self, fips):
+        """Warns about FIPS codes that cannot be drawn; returns them."""
+        missing = self.unmatched(fips)
+        if missing:
+            warnings.warn('no county outline for FIPS {}'.format(
+                ', '.join('{:05d}'.format(f) for f in missing)))
+        return missing
+
+
+if __name__ == '__main__':
+    import time
+    geometry = CountyGeometry()
+    start = time.perf_counter()
+    manifest = geometry.build()
+    print('built {} levels for {} states in {:.1f} s'.format(
+        len(manifest['levels']), len(manifest['states']),
+        time.perf_counter() - start))
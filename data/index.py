@@ -0,0 +1,97 @@
+"""Column and row indexes over the CHSI tables."""
+import re
+import numpy as np
+
+# <age group>_<race>_<cause>, e.g. D_Wh_Homicide; confidence interval
+# columns (CI_Min_..., CI_Max_...) do not match
+MEASURE = re.compile(r'^([A-F])_([A-Za-z]+)_([A-Za-z]+)$')
+DIMENSIONS = ('age', 'race', 'cause')
+
+
+def fips_codes(df) -> np.ndarray:
+    """Five digit FIPS codes as integers, state * 1000 + county."""
+    return (df['State_FIPS_Code'].to_numpy(dtype=np.int64) * 1000
+            + df['County_FIPS_Code'].to_numpy(dtype=np.int64))
+
+
+class ColumnIndex():
+
+    def __init__(self, columns):
+        """
+        Column names of a CHSI table parsed once into (age, race, cause)
+        keys, so columns are found by dict lookups instead of scanning the
+        header.
+
+        Parameters
+        ----------
+        columns : column names, e.g. a DataFrame's columns
+        """
+        self.names = {name: i for i, name in enumerate(columns)}
+        self.keys = {}
+        values = ([], [], [])
+        for name in self.names:
+            match = MEASURE.match(name)
+            if match is None:
+                continue
+            age, race, cause = match.groups()
+            # the header has a C_Ot_homicide next to C_*_Homicide
+            key = (age, race, cause[:1].upper() + cause[1:])
+            self.keys[key] = name
+            for value, seen in zip(key, values):
+                if value not in seen:
+                    seen.append(value)
+        # values of every dimension in header order
+        self.values = dict(zip(DIMENSIONS, values))
+
+    def __contains__(self, name) -> bool:
+        return name in self.names
+
+    def column(self, age, race, cause):
+        """Name of the (age, race, cause) column, None if there is none."""
+        return self.keys.get((age, race, cause))
+
+    def match(self, age=None, race=None, cause=None) -> list:
+        """
+        (key, column name) of the columns matching the given values, in
+        header order. Each argument is a value, a list of values or None for
+        any value.
+        """
+        wanted = []
+        for values in (age, race, cause):
+            if isinstance(values, str):
+                values = [values]
+            wanted.append(None if values is None else set(values))
+        return [(key, name) for key, name in self.keys.items()
+                if all(w is None or v in w for v, w in zip(key, wanted))]
+
+
+class FipsIndex():
+
+    def __init__(self, fips):
+        """
+        Row positions by five digit FIPS code. Codes are kept sorted, so the
+        rows of a county or a whole state are one binary search away.
+
+        Parameters
+        ----------
+        fips : integer FIPS code of every row, see `fips_codes`
+        """
+        fips = np.asarray(fips, dtype=np.int64)
+        self.order = np.argsort(fips, kind='stable')
+        self.sorted = fips[self.order]
+
+    def rows(self, states=(), counties=()) -> np.ndarray:
+        """
+        Positions of the rows in any of the given states (two digit codes)
+        or counties (five digit codes), ascending. All rows when neither is
+        given.
+        """
+        if not len(states) and not len(counties):
+            return np.arange(len(self.sorted))
+        bounds = [(s * 1000, s * 1000 + 1000) for s in states]
+        bounds += [(c, c + 1) for c in counties]
+        lo, hi = np.array(bounds, dtype=np.int64).T
+        starts = np.searchsorted(self.sorted, lo)
+        stops = np.searchsorted(self.sorted, hi)
+        rows = [self.order[a:b] for a, b in zip(starts, stops)]
+        return np.unique(np.concatenate(rows))
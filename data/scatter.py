@@ -0,0 +1,73 @@
+"""Derived arrays of the 3D scatter, computed from the demographics table."""
+import numpy as np
+
+# number of poverty slices and the colorscale the slices are drawn from
+SLICENUM = 38
+PORTLAND = [[0, 'rgb(12,51,131)'], [0.25, 'rgb(10,136,186)'],
+			[0.5, 'rgb(242,211,56)'], [0.75, 'rgb(242,143,56)'],
+			[1, 'rgb(217,30,30)']]
+# cells per axis of the level of detail grid, see scatter_lod in app.py
+LOD_BINS = 16
+# age groups with a y column of their own, see app.age_group
+SCATTER_AGES = ('A', 'D', 'F')
+
+def scatter_arrays(demogr, in_age='A') -> dict:
+	"""
+	3D scatter arrays of one age group ('A', 'D' or 'F') of the raw
+	demographics frame. All arrays are read only.
+
+	Besides x/y/z and the marker sizes, counties are stably sorted by the
+	poverty slice they fall in, so slice i is the contiguous row range
+	bounds[i]:bounds[i+1] of x_sorted/y_sorted, in the original row order.
+	"""
+	cols = demogr.columns.tolist()
+	if in_age == 'A':
+		y = demogr[cols[17]]
+		titley = "y = Age Under 19 (%)"
+	elif in_age == 'D':
+		y = demogr[cols[20]]
+		titley = "y = Age 19-64 (%)"
+	elif in_age == 'F':
+		y = demogr[cols[23]] + demogr[cols[26]]
+		titley = "y = Age Above 64 (%)"
+	else:
+		raise ValueError('unknown age group: {}'.format(in_age))
+
+	# log10(population density), poverty, log10(population)
+	x = np.log10(demogr[cols[11]].replace([-2222,0], [demogr[cols[11]].mean(),1]))
+	z = demogr[cols[14]].replace(-2222.2, demogr[cols[14]].mean())
+	x, y, z = x.to_numpy(), y.to_numpy(), z.to_numpy()
+	size = np.log10(demogr[cols[8]]).to_numpy() * 2
+
+	# slice i holds slices[i] <= z < slices[i+1]
+	slices = np.linspace(0, max(z), SLICENUM)
+	bucket = np.searchsorted(slices, z, side='right') - 1
+	order = np.argsort(bucket, kind='stable')
+	bounds = np.searchsorted(bucket[order], np.arange(SLICENUM + 1))
+
+	# the grey plane drawn at the slice level
+	p1, p2 = np.meshgrid(np.linspace(0, max(x), 5), np.linspace(0, max(y), 5))
+
+	# level of detail: the first county of every occupied grid cell
+	cells = np.zeros(len(x), dtype=np.int64)
+	for values in (x, y, z):
+		span = np.ptp(values) or 1
+		cell = ((values - values.min()) / span * LOD_BINS).astype(np.int64)
+		cells = cells * (LOD_BINS + 1) + cell
+	lod = np.sort(np.unique(cells, return_index=True)[1])
+
+	arrays = dict(x=x, y=y, z=z, size=size, slices=slices, bounds=bounds,
+				  x_sorted=x[order], y_sorted=y[order], size_sorted=size[order],
+				  p1=p1, p2=p2, lod=lod, order=order, position=np.argsort(order))
+	freeze(arrays)
+	arrays['titley'] = titley
+	# only needed when the arrays are computed, not when loaded from the pipeline
+	import colorlover
+	arrays['palette'] = tuple(colorlover.interp([c for _, c in PORTLAND], SLICENUM))
+	return arrays
+
+def freeze(arrays):
+	"""Makes the numpy arrays of a dict read only, in place."""
+	for a in arrays.values():
+		if isinstance(a, np.ndarray):
+			a.flags.writeable = False
@@ -0,0 +1,158 @@
+"""Typed loader for the CHSI tables, driven by the dataset's own metadata.
+
+DATAELEMENTDESCRIPTION.csv gives the type of every column (Text, Integer or
+Decimal) and DEFINEDDATAVALUE.csv the coded values, the negative ones being
+"no data" markers. `read_typed` uses both to give every table explicit
+dtypes instead of the 64 bit types pandas infers:
+  Integer, Decimal  float32, so the sentinels can become NaN
+  Text              category
+  FIPS codes        int16, plus an int32 FIPS column, state * 1000 + county
+Confidence interval columns (CI_*) are dropped, and the sentinels are
+masked in one pass over the numeric block. Tables are read through the
+columnar cache like Dataset's (see data/cache.py), and DataStore loads its
+domains with it when asked to (`typed=True`).
+
+Run ``python -m data.schema`` to compare it with pandas' inference plus
+Dataset.preproc on every CHSI table.
+"""
+from pathlib import Path
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from data.cache import read_csv
+
+DESCRIPTION = 'DATAELEMENTDESCRIPTION.csv'
+DEFINED_VALUES = 'DEFINEDDATAVALUE.csv'
+FIPS_COLUMNS = ('State_FIPS_Code', 'County_FIPS_Code')
+DTYPES = {'Text': 'category', 'Integer': 'float32', 'Decimal': 'float32'}
+
+
+class Schema():
+
+    def __init__(self, data_dir='./data'):
+        """
+        Column types and sentinel values of the CHSI tables.
+
+        Parameters
+        ----------
+        data_dir : folder that holds DATAELEMENTDESCRIPTION.csv and
+                   DEFINEDDATAVALUE.csv
+        """
+        data_dir = Path(data_dir)
+        desc = pd.read_csv(data_dir / DESCRIPTION, usecols=['COLUMN_NAME', 'DATA_TYPE'])
+        # key columns appear once per page, with the same type everywhere
+        self.types = dict(zip(desc['COLUMN_NAME'], desc['DATA_TYPE']))
+
+        # '-2222 or -2222.2 or -2': every negative value stands for no data,
+        # the positive ones are the codes of the indicator columns
+        values = pd.read_csv(data_dir / DEFINED_VALUES, dtype=str)['Data_Value']
+        codes = [float(v) for vs in values for v in vs.split(' or ')]
+        self.sentinels = np.array(sorted(v for v in codes if v < 0), dtype=np.float32)
+
+    def dtypes(self, columns) -> dict:
+        """{column: dtype} the given columns are converted to."""
+        dtypes = {col: DTYPES.get(self.types.get(col), 'float32') for col in columns}
+        dtypes.update({col: 'int16' for col in FIPS_COLUMNS if col in dtypes})
+        return dtypes
+
+
+def read_typed(filename, schema=None, cache=True) -> pd.DataFrame:
+    """
+    A CHSI csv with schema dtypes, without CI_* columns, sentinels as NaN
+    and an integer FIPS column.
+
+    Passing the schema to pd.read_csv (dtype=, na_values=) parses slower
+    than inference on every CHSI table: the C parser reads numbers as
+    float64 and casts them afterwards, and builds categoricals slower than
+    converting the parsed text. So the table is read with inferred types,
+    through the columnar cache unless `cache` is False, and converted in
+    bulk: the numeric columns are cast into one float32 block, where the
+    sentinels are masked in place, and the text columns become categoricals.
+
+    Parameters
+    ----------
+    filename : csv filename that contains CHSI data
+    schema : Schema, defaults to the one next to the csv
+    cache : read through the columnar cache, see data/cache.py
+    """
+    schema = Schema(Path(filename).parent) if schema is None else schema
+    if cache:
+        df = read_csv(filename)
+        df = df[[col for col in df.columns if not col.startswith('CI_')]]
+    else:
+        df = pd.read_csv(filename, usecols=lambda col: not col.startswith('CI_'))
+    columns = list(df.columns)
+    dtypes = schema.dtypes(columns)
+
+    numeric = [col for col in columns if dtypes[col] == 'float32']
+    block = df[numeric].to_numpy(dtype=np.float32, copy=True)
+    block[np.isin(block, schema.sentinels)] = np.nan
+    typed = pd.DataFrame(block, columns=numeric, copy=False)
+    for i, col in enumerate(columns):
+        if dtypes[col] != 'float32':
+            typed.insert(i, col, df[col].astype(dtypes[col]))
+    typed['FIPS'] = (typed['State_FIPS_Code'].to_numpy(dtype=np.int32) * 1000
+                     + typed['County_FIPS_Code'].to_numpy(dtype=np.int32))
+    return typed
+
+
+def profile(func, repeat=3):
+    """(best seconds, peak traced MB) of calling func."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        return min(times), tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(filenames, repeat=3):
+    """
+    Times and traces read_typed against Dataset.preproc on the inferred
+    frame, both parsing the csv and both reading the columnar cache, and
+    the size of the resulting frames. Returns a list of result dicts.
+    """
+    from data.dataset import Dataset
+    schema = Schema(Path(filenames[0]).parent)
+
+    def inferred(filename, cache):
+        dataset = Dataset(filename, cache=cache)
+        dataset.preproc()
+        return dataset.df
+
+    results = []
+    for filename in filenames:
+        result = {'file': str(filename)}
+        for name, func in (('inferred', lambda: inferred(filename, False)),
+                           ('typed', lambda: read_typed(filename, schema, False)),
+                           ('inferred cached', lambda: inferred(filename, True)),
+                           ('typed cached', lambda: read_typed(filename, schema))):
+            seconds, peak = profile(func, repeat)
+            result[name] = {'seconds': seconds, 'peak_mb': peak,
+                            'frame_mb': func().memory_usage(deep=True).sum() / 2**20}
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    from data.store import DOMAINS
+    files = sys.argv[1:] or [Path('./data') / f for f in DOMAINS.values()]
+    print('inferred: Dataset + preproc, typed: read_typed; '
+          'from the csv, then through the columnar cache')
+    print('{:<32} {:>35} {:>17} {:>17}'.format('', 'load ms', 'peak MB', 'frame MB'))
+    print('{:<32}{}{}'.format('', ' {:>8} {:>8}'.format('inferred', 'typed') * 2,
+                              ' {:>8} {:>8}'.format('inferred', 'typed') * 2))
+    for r in benchmark(files):
+        a, b = r['inferred'], r['typed']
+        c, d = r['inferred cached'], r['typed cached']
+        print('{:<32} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f}'.format(
+            Path(r['file']).name, a['seconds'] * 1e3, b['seconds'] * 1e3,
+            c['seconds'] * 1e3, d['seconds'] * 1e3,
+            a['peak_mb'], b['peak_mb'], a['frame_mb'], b['frame_mb']))
@@ -0,0 +1,272 @@
+"""County level correlations between demographics and causes of death.
+
+Every demographics measure is correlated with every leading causes of death
+column over the counties of the country or of one state, as a handful of
+matrix products over the county x column arrays. Missing and invalid values
+(see DEFINEDDATAVALUE.csv) are skipped pairwise: a pair of columns is
+correlated over the counties where both are valid.
+
+Pearson correlates the values, Spearman their ranks among the counties a
+pair shares. The sort order and ties of every column are computed once per
+state, so ranking a column within any subset of counties is a cumulative
+count along that order, done for all columns at once.
+"""
+from collections import OrderedDict
+import threading
+import numpy as np
+import pandas as pd
+from data.dataset import SENTINELS
+from data.index import MEASURE
+from data.tensor import quiet
+
+METHODS = ('pearson', 'spearman')
+# fewer counties than this give a NaN correlation
+MIN_COUNTIES = 3
+
+
+def demographic_columns(df) -> list:
+    """
+    County measures of the demographics table, from Population_Size on,
+    without the Min_/Max_ ranges of the peer county strata.
+    """
+    cols = df.columns.tolist()
+    return [col for col in cols[cols.index('Population_Size'):]
+            if not col.startswith(('Min_', 'Max_'))]
+
+
+def masked(values) -> np.ndarray:
+    """float64 copy of a county x column array with the sentinels as NaN."""
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isin(values, SENTINELS), np.nan, values)
+
+
+def rank_order(values) -> tuple:
+    """
+    (order, first, last) of every row of a column x county array: the
+    stable sort order, NaN last, and per sorted position the first and last
+    sorted position of its run of equal values.
+    """
+    n = values.shape[-1]
+    order = np.argsort(values, axis=-1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=-1)
+    positions = np.arange(n)
+    # NaN != NaN, so every NaN is a run of its own
+    change = ordered[:, 1:] != ordered[:, :-1]
+    edge = np.ones((len(values), 1), bool)
+    first = np.where(np.hstack([edge, change]), positions, 0)
+    last = np.where(np.hstack([change, edge]), positions, n)
+    return (order, np.maximum.accumulate(first, axis=-1),
+            np.minimum.accumulate(last[:, ::-1], axis=-1)[:, ::-1])
+
+
+def ranks(order, mask) -> np.ndarray:
+    """
+    Average ranks of each row of a column x county mask among its counties
+    in the mask, 0 outside of it, from the rank_order of the columns
+    (broadcast to the mask's shape).
+    """
+    order, first, last = (np.broadcast_to(a, mask.shape) for a in order)
+    inside = np.take_along_axis(mask, order, axis=-1)
+    count = np.cumsum(inside, axis=-1)
+    # the k counties of a run inside the mask share the mean of the ranks
+    # before + 1 .. before + k
+    before = np.take_along_axis(count - inside, first, axis=-1)
+    through = np.take_along_axis(count, last, axis=-1)
+    ordered = np.where(inside, (before + 1 + through) / 2, 0)
+    result = np.empty(mask.shape)
+    np.put_along_axis(result, order, ordered, axis=-1)
+    return result
+
+
+def correlate(x, y, min_counties=MIN_COUNTIES) -> np.ndarray:
+    """
+    Pearson correlation of every column of x with every column of y, both
+    county x column arrays, NaN skipped pairwise. Returns an array of shape
+    (x columns, y columns).
+    """
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    # centered first, so the sums of squares below do not cancel; columns
+    # without any value have a NaN mean, and correlate as NaN below
+    x = np.where(mx, x - quiet(np.nanmean, np.where(mx, x, np.nan), axis=0), 0)
+    y = np.where(my, y - quiet(np.nanmean, np.where(my, y, np.nan), axis=0), 0)
+    mx, my = mx.astype(np.float64), my.astype(np.float64)
+
+    n = mx.T @ my
+    sx, sy = x.T @ my, mx.T @ y
+    sxx, syy = (x * x).T @ my, mx.T @ (y * y)
+    sxy = x.T @ y
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var = (sxx - sx * sx / n) * (syy - sy * sy / n)
+        r = cov / np.sqrt(var)
+    r[(n < min_counties) | ~(var > 0)] = np.nan
+    return np.clip(r, -1, 1)
+
+
+def spearman(x, y, x_order, y_order, min_counties=MIN_COUNTIES) -> np.ndarray:
+    """
+    Spearman correlation of every column of x with every column of y, both
+    county x column arrays, each pair ranked among the counties where both
+    are valid. `x_order` and `y_order` are the rank_order of x.T and y.T.
+    Returns an array of shape (x columns, y columns).
+    """
+    mx, my = ~np.isnan(x.T), ~np.isnan(y.T)
+    # the y ranks only depend on which counties x is missing, and most x
+    # columns miss the same (or no) counties
+    patterns, pattern = np.unique(mx, axis=0, return_inverse=True)
+    pattern = pattern.ravel()
+    rows = np.arange(len(mx))
+    r = np.empty((len(mx), len(my)))
+    # one column of y against all columns of x at a time
+    for j in range(len(my)):
+        mask = mx & my[j]
+        x_ranks = ranks(x_order, mask)
+        y_ranks = ranks(tuple(o[j] for o in y_order), patterns & my[j])
+        # both rank the same n counties, so both have the mean (n + 1) / 2
+        n = mask.sum(axis=-1)
+        square = n * ((n + 1) / 2) ** 2
+        sxy = (x_ranks @ y_ranks.T)[rows, pattern]
+        sxx = np.einsum('ij,ij->i', x_ranks, x_ranks)
+        syy = np.einsum('ij,ij->i', y_ranks, y_ranks)[pattern]
+        var = (sxx - square) * (syy - square)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r[:, j] = (sxy - square) / np.sqrt(var)
+        r[(n < min_counties) | ~(var > 0), j] = np.nan
+    return np.clip(r, -1, 1)
+
+
+class Correlations():
+
+    def __init__(self, store, maxsize=64):
+        """
+        Correlation matrices of the demographics against the leading causes
+        of death, per state and column set. The masked arrays and rank
+        orders of a state are prepared once, the matrices are kept in an LRU
+        cache.
+
+        Parameters
+        ----------
+        store : DataStore, whose demographics and leading causes of death
+                domains share one FIPS index
+        maxsize : maximum number of cached matrices
+        """
+        self.store = store
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._states = {}
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def x_columns(self) -> list:
+        return demographic_columns(self.store.domain('demographics'))
+
+    @property
+    def y_columns(self) -> list:
+        """(age, race, cause) columns, see data/index.py"""
+        df = self.store.domain('leading_causes_of_death')
+        return [name for name in df.columns if MEASURE.match(name)]
+
+    def arrays(self, state=None) -> dict:
+        """
+        Masked values and rank orders of every column for the counties of a state
+        (two digit FIPS code), all counties for None.
+        """
+        arrays = self._states.get(state)
+        if arrays is not None:
+            return arrays
+        demogr = self.store.domain('demographics')
+        deaths = self.store.domain('leading_causes_of_death')
+        rows = slice(None)
+        if state is not None:
+            rows = demogr.index.to_numpy() // 1000 == int(state)
+        arrays = {}
+        for axis, df, cols in (('x', demogr, self.x_columns),
+                               ('y', deaths, self.y_columns)):
+            values = masked(df[cols].to_numpy()[rows])
+            arrays[axis] = {'columns': cols, 'values': values,
+                            'order': rank_order(values.T),
+                            'position': {c: i for i, c in enumerate(cols)}}
+        # two threads may prepare the same state, both get the same result
+        return self._states.setdefault(state, arrays)
+
+    def matrix(self, method='pearson', state=None, x=None, y=None) -> pd.DataFrame:
+        """
+        Correlations as a frame with the demographics columns `x` as rows and
+        the cause of death columns `y` as columns, all columns for None.
+        The returned frame is shared with the cache and must not be modified.
+
+        Parameters
+        ----------
+        method : 'pearson' or 'spearman'
+        state : two digit state FIPS code, None for all counties
+        x, y : column names, in the order wanted
+        """
+        if method not in METHODS:
+            raise ValueError('unknown correlation method: {}'.format(method))
+        state = None if state is None else int(state)
+        key = (method, state, None if x is None else tuple(x),
+               None if y is None else tuple(y))
+        with self._lock:
+            frame = self._matrices.get(key)
+            if frame is not None:
+                self._matrices.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        with self._lock:
+            full = self._matrices.get((method, state, None, None))
+            if full is not None:
+                self._matrices.move_to_end((method, state, None, None))
+        if full is not None:
+            # pairwise correlations, a column subset is a slice of all of them
+            frame = full.loc[full.index if x is None else list(x),
+                             full.columns if y is None else list(y)]
+            return self._store(key, frame)
+
+        arrays = self.arrays(state)
+        picked = []
+        for axis, cols in (('x', x), ('y', y)):
+            a = arrays[axis]
+            cols = a['columns'] if cols is None else list(cols)
+            where = [a['position'][c] for c in cols]
+            picked.append((cols, a['values'][:, where],
+                           tuple(o[where] for o in a['order'])))
+        (x, xv, xo), (y, yv, yo) = picked
+        if method == 'pearson':
+            r = correlate(xv, yv)
+        else:
+            r = spearman(xv, yv, xo, yo)
+        return self._store(key, pd.DataFrame(r, index=x, columns=y))
+
+    def _store(self, key, frame) -> pd.DataFrame:
+        """Caches a matrix, evicting the least recently used ones."""
+        with self._lock:
+            self._matrices[key] = frame
+            self._matrices.move_to_end(key)
+            while len(self._matrices) > self.maxsize:
+                self._matrices.popitem(last=False)
+                self.evictions += 1
+        return frame
+
+    def national(self) -> dict:
+        """{method: all columns matrix over all counties}"""
+        return {method: self.matrix(method) for method in METHODS}
+
+    def seed(self, matrices):
+        """
+        Adds precomputed `national` matrices, e.g. a pipeline artifact, so
+        the heatmaps of all counties are sliced from them.
+        """
+        for method, frame in matrices.items():
+            self._store((method, None, None, None), frame)
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters plus the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._matrices),
+                    'maxsize': self.maxsize}
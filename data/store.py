@@ -0,0 +1,153 @@
+"""FIPS indexed store over all county level CHSI tables."""
+from pathlib import Path
+import threading
+import numpy as np
+import pandas as pd
+from data.dataset import Dataset
+from data.index import fips_codes
+from data.schema import Schema, read_typed
+
+# county level CHSI tables, one per indicator domain
+DOMAINS = {
+    'demographics': 'DEMOGRAPHICS.csv',
+    'leading_causes_of_death': 'LEADINGCAUSESOFDEATH.csv',
+    'measures_of_birth_and_death': 'MEASURESOFBIRTHANDDEATH.csv',
+    'preventive_services_use': 'PREVENTIVESERVICESUSE.csv',
+    'relative_health_importance': 'RELATIVEHEALTHIMPORTANCE.csv',
+    'risk_factors_and_access_to_care': 'RISKFACTORSANDACCESSTOCARE.csv',
+    'summary_measures_of_health': 'SUMMARYMEASURESOFHEALTH.csv',
+    'vulnerable_pops_and_env_health': 'VUNERABLEPOPSANDENVHEALTH.csv',
+}
+
+
+class DataStore():
+
+    def __init__(self, data_dir='./data', cache=True, mmap=False, typed=False):
+        """
+        All county level CHSI domains aligned on one sorted FIPS index.
+        Domains are loaded through Dataset on first access; the column to
+        domain map is built from the csv headers only, so naming a column
+        never loads more than the domain that holds it. The headers are
+        read on the first lookup by column name, not here.
+
+        The shared index is taken from the demographics table. Every other
+        domain is reindexed onto it, so frames from different domains can
+        be combined without any alignment work.
+
+        Parameters
+        ----------
+        data_dir : folder that holds the CHSI csv files
+        cache : passed on to Dataset, load through the columnar cache
+        mmap : passed on to Dataset, memory map the numeric columns; domains
+               that are already in FIPS order are then never copied
+        typed : load the domains with data.schema.read_typed instead of
+                Dataset: float32 measures with NaN for no data, categorical
+                text and no CI_* columns. The app draws from the raw values,
+                so it keeps the default.
+        """
+        self.data_dir = Path(data_dir)
+        self.cache = cache
+        self.mmap = mmap
+        self.typed = typed
+        self._schema = None
+        self._frames = {}
+        self._series = {}
+        self._index = None
+        self._columns = None
+        self._lock = threading.RLock()
+
+    @property
+    def columns(self) -> dict:
+        """{column: domain} of every csv column, from the csv headers."""
+        if self._columns is None:
+            # key columns resolve to the first domain, demographics
+            columns = {}
+            for name, filename in DOMAINS.items():
+                header = pd.read_csv(self.data_dir / filename, nrows=0).columns
+                for col in header:
+                    if not (self.typed and col.startswith('CI_')):
+                        columns.setdefault(col, name)
+            self._columns = columns
+        return self._columns
+
+    @property
+    def index(self) -> pd.Index:
+        """Sorted FIPS index shared by every domain frame."""
+        if self._index is None:
+            self.domain('demographics')
+        return self._index
+
+    def domain(self, name) -> pd.DataFrame:
+        """
+        Returns the domain frame indexed by FIPS, loading it on first access.
+        The frame keeps all csv columns in their original order.
+        """
+        frame = self._frames.get(name)
+        if frame is not None:
+            return frame
+        with self._lock:
+            if name in self._frames:
+                return self._frames[name]
+            if name not in DOMAINS:
+                raise KeyError('unknown CHSI domain: {}'.format(name))
+            index = self.index if name != 'demographics' else None
+            if self.typed:
+                if self._schema is None:
+                    self._schema = Schema(self.data_dir)
+                df = read_typed(self.data_dir / DOMAINS[name], self._schema, self.cache)
+            else:
+                df = Dataset(self.data_dir / DOMAINS[name], cache=self.cache,
+                             mmap=self.mmap).df
+            df.index = pd.Index(fips_codes(df), name='FIPS')
+            if index is None:
+                if not df.index.is_monotonic_increasing:
+                    df = df.sort_index()
+                self._index = df.index
+            else:
+                if not df.index.equals(index):
+                    df = df.reindex(index)
+                # share the very same index object, so joins skip alignment
+                df.index = index
+            self._frames[name] = df
+            return df
+
+    def column(self, name) -> pd.Series:
+        """Returns a column by name from whichever domain holds it."""
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = self.domain(self.columns[name])[name]
+        return series
+
+    def join(self, *names) -> pd.DataFrame:
+        """
+        Columns from any mix of domains as one FIPS indexed frame. All
+        columns already share the index, so only the raw arrays are passed on.
+        """
+        return pd.DataFrame({name: self.column(name).to_numpy() for name in names},
+                            index=self.index, copy=False)
+
+    def rows(self, fips) -> np.ndarray:
+        """Row positions in the shared index for a list of FIPS codes."""
+        return self.index.get_indexer(np.asarray(fips, dtype=np.int64))
+
+    def refresh(self, filenames) -> 'DataStore':
+        """
+        New store over the same folder for a reload of `filenames`: domains
+        backed by those files are read again on access, every other loaded
+        frame is shared with this store. A new demographics table may bring
+        a new index, so then nothing is shared.
+        """
+        changed = {Path(f).resolve() for f in filenames}
+        names = {name for name, filename in DOMAINS.items()
+                 if (self.data_dir / filename).resolve() in changed}
+        if not names:
+            return self
+        store = DataStore(self.data_dir, self.cache, self.mmap, self.typed)
+        if 'demographics' not in names:
+            with self._lock:
+                store._index = self._index
+                store._frames = {n: df for n, df in self._frames.items()
+                                 if n not in names}
+                store._series = {c: s for c, s in self._series.items()
+                                 if store.columns.get(c) in store._frames}
+        return store
@@ -0,0 +1,131 @@
+"""Dense county x age x race x cause array of a leading causes of death table."""
+import warnings
+import numpy as np
+from data.index import DIMENSIONS, fips_codes
+
+AXES = ('county',) + DIMENSIONS
+
+
+def quiet(func, *args, **kwargs):
+    """Calls a nan reduction without its all-NaN slice warnings."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(*args, **kwargs)
+
+
+class Tensor():
+
+    def __init__(self, values, axes):
+        """
+        float32 array with named, labeled axes. Invalid and missing values
+        are NaN, `valid` is the mask of the others. Reductions skip NaN and
+        name the axes they run along, e.g. for a leading causes of death
+        tensor (see `from_dataset`):
+
+          t.mean('county', 'age')                   national, by race and cause
+          t.by_state().select(age='D').mean('race') states by cause, 25-44
+          np.argsort(-t.values, axis=-1)            cause ranking per county
+
+        Parameters
+        ----------
+        values : array, one dimension per axis
+        axes : {axis name: labels}, in dimension order
+        """
+        self.values = values
+        self.axes = {name: np.asarray(labels) for name, labels in dict(axes).items()}
+
+    @classmethod
+    def from_dataset(cls, dataset, sentinels=()):
+        """
+        Tensor of a raw CHSI Dataset, county x age x race x cause. Columns
+        that do not exist (no B_*_Comp, say) and `sentinels` are NaN.
+        """
+        index = dataset.column_index
+        labels = [index.values[dim] for dim in DIMENSIONS]
+        positions = [{label: i for i, label in enumerate(ls)} for ls in labels]
+        keys, names = zip(*index.keys.items())
+        raw = dataset.df[list(names)].to_numpy(dtype=np.float64)
+        raw = np.where(np.isin(raw, sentinels), np.nan, raw)
+
+        fips = fips_codes(dataset.df)
+        values = np.full((len(fips),) + tuple(map(len, labels)), np.nan, np.float32)
+        where = tuple(np.array([p[k[i]] for k in keys]) for i, p in enumerate(positions))
+        values[(slice(None),) + where] = raw
+        return cls(values, zip(AXES, [fips] + labels))
+
+    @property
+    def valid(self) -> np.ndarray:
+        return ~np.isnan(self.values)
+
+    def axis(self, name) -> int:
+        return list(self.axes).index(name)
+
+    def select(self, **labels):
+        """
+        Tensor of the given labels per axis. A single label drops its axis,
+        a list keeps it, e.g. select(age='D', race=['Wh', 'Bl']).
+        """
+        index, axes = [], {}
+        for name, axis_labels in self.axes.items():
+            wanted = labels.get(name)
+            if wanted is None:
+                index.append(slice(None))
+                axes[name] = axis_labels
+                continue
+            positions = {label: i for i, label in enumerate(axis_labels.tolist())}
+            if isinstance(wanted, (list, tuple, np.ndarray)):
+                index.append(np.array([positions[w] for w in wanted], dtype=np.intp))
+                axes[name] = axis_labels[index[-1]]
+            else:
+                index.append(positions[wanted])
+        # one axis at a time from the last, numpy would broadcast several
+        # fancy indexes against each other
+        values = self.values
+        for dim in reversed(range(len(index))):
+            values = values[(slice(None),) * dim + (index[dim],)]
+        return Tensor(values, axes)
+
+    def reduce(self, func, *axes):
+        """Tensor of func (a nan reduction) along the named axes."""
+        dims = tuple(self.axis(a) for a in axes)
+        values = quiet(func, self.values, axis=dims)
+        return Tensor(values, {k: v for k, v in self.axes.items() if k not in axes})
+
+    def mean(self, *axes):
+        return self.reduce(np.nanmean, *axes)
+
+    def sum(self, *axes):
+        """NaN where all summed values are NaN, unlike np.nansum."""
+        sums = self.reduce(np.nansum, *axes)
+        sums.values[self.count(*axes).values == 0] = np.nan
+        return sums
+
+    def max(self, *axes):
+        return self.reduce(np.nanmax, *axes)
+
+    def min(self, *axes):
+        return self.reduce(np.nanmin, *axes)
+
+    def count(self, *axes):
+        """Number of valid values along the named axes."""
+        dims = tuple(self.axis(a) for a in axes)
+        return Tensor(self.valid.sum(axis=dims),
+                      {k: v for k, v in self.axes.items() if k not in axes})
+
+    def by_state(self):
+        """
+        Means over the counties of each state, the county axis replaced by
+        a 'state' axis of two digit state FIPS codes.
+        """
+        # dataset.py imports this module
+        from data.dataset import grouped_nanmean
+        fips = self.axes['county']
+        order = np.argsort(fips, kind='stable')
+        states = fips[order] // 1000
+        starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+        dim = self.axis('county')
+        values = np.moveaxis(self.values, dim, 0)[order]
+        means = grouped_nanmean(values, starts).astype(np.float32)
+        axes = {('state' if k == 'county' else k): v for k, v in self.axes.items()}
+        axes['state'] = states[starts]
+        return Tensor(np.moveaxis(means, 0, dim), axes)
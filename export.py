@@ -0,0 +1,225 @@
+"""Static snapshot of every dashboard state.
+
+The dataset never changes, so every state the controls can reach can be
+rendered ahead of time: each distinct figure of the ages x cods x radio1 x
+slider1 grid is written as JSON, next to an index mapping every control
+combination to its figure, an HTML shell with the same controls, plotly.js
+and the assets. The result is a static site that any file server or CDN can
+serve, e.g. ``python -m http.server -d site``.
+
+Figures are rendered by a process pool over all cores. Reruns are
+incremental: a figure is only rendered again when its inputs or the hash of
+the code and data it is built from changed, or its file is gone.
+
+    python export.py [out dir] [--workers N] [--force]
+"""
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parent
+# everything the figures are built from
+SOURCES = ['app.py', 'figcache.py', 'pipeline.py', 'data/*.py',
+           'data/LEADINGCAUSESOFDEATH.csv', 'data/DEMOGRAPHICS.csv']
+MANIFEST = 'manifest.json'
+
+
+def code_hash() -> str:
+    """sha1 over the code and data files the figures are built from."""
+    sha1 = hashlib.sha1()
+    for pattern in SOURCES:
+        for path in sorted(ROOT.glob(pattern)):
+            sha1.update(path.relative_to(ROOT).as_posix().encode())
+            sha1.update(path.read_bytes())
+    return sha1.hexdigest()
+
+
+def key_str(key) -> str:
+    """Control values as used in the index, e.g. 'D,1,10'."""
+    return ','.join(str(k) for k in key)
+
+
+def states(app) -> dict:
+    """
+    {graph: {control values: (figure file, builder args)}} for every
+    combination of the controls. Combinations that draw the same figure
+    share a file.
+    """
+    ages = [o['value'] for o in app.ages_dropdown]
+    causes = [o['value'] for o in app.causes_dropdown]
+    radio = [o['value'] for o in app.slices_radio]
+    slider = range(0, 31)
+    scatter, choro = {}, {}
+    for age in ages:
+        for s in radio:
+            for r in slider:
+                key = app.snapshot.scatter.figures.key(age, s, r)
+                scatter[key_str((age, s, r))] = (
+                    'scatter/{}.json'.format('_'.join(map(str, key))), (age, s, r))
+        for cause in causes:
+            # not every age group has every cause, e.g. there is no B_HIV column
+            if age+'_'+cause in app.snapshot.choro.state_cod.columns:
+                choro[key_str((age, cause))] = (
+                    'choropleth/{}_{}.json'.format(age, cause), (age, cause))
+    return {'scatter3d': scatter, 'choropleth': choro}
+
+
+def render(job):
+    """Writes one figure file, in a pool worker. Returns (file, seconds)."""
+    import app
+    import plotly
+    graph, file, args, out = job
+    start = time.perf_counter()
+    data = app.snapshot.scatter if graph == 'scatter3d' else app.snapshot.choro
+    cache = data.figures
+    body = json.dumps(cache.get(*args), cls=plotly.utils.PlotlyJSONEncoder,
+                      separators=(',', ':'))
+    path = Path(out) / 'figures' / file
+    tmp = path.with_name('.{}.{}'.format(path.name, os.getpid()))
+    tmp.write_text(body)
+    os.replace(tmp, path)
+    return file, time.perf_counter() - start
+
+
+def write_shell(app, out, index):
+    """index.html, plotly.js and the assets the page uses."""
+    import plotly
+    plotly_js = Path(plotly.__file__).parent / 'package_data' / 'plotly.min.js'
+    shutil.copyfile(plotly_js, out / 'plotly.min.js')
+    (out / 'assets').mkdir(exist_ok=True)
+    for asset in ('stylesheet.css', 'logo2.png'):
+        shutil.copyfile(ROOT / 'assets' / asset, out / 'assets' / asset)
+
+    def options(name, items, value):
+        return '<select id="{}">{}</select>'.format(name, ''.join(
+            '<option value="{}"{}>{}</option>'.format(
+                o['value'], ' selected' if o['value'] == value else '', o['label'])
+            for o in items))
+
+    radio = ''.join('<label><input type="radio" name="radio1" value="{}"{}>{}</label>'.format(
+        o['value'], ' checked' if o['value'] == 0 else '', o['label'])
+        for o in app.slices_radio)
+    html = SHELL.format(cods=options('cods', app.causes_dropdown, 'Homicide'),
+                        ages=options('ages', app.ages_dropdown, 'D'),
+                        radio=radio, index=json.dumps(index))
+    (out / 'index.html').write_text(html)
+
+
+def export(out, workers=None, force=False) -> dict:
+    """Renders the static site into `out`. Returns counts of the run."""
+    import app
+    out = Path(out)
+    (out / 'figures' / 'scatter').mkdir(parents=True, exist_ok=True)
+    (out / 'figures' / 'choropleth').mkdir(parents=True, exist_ok=True)
+
+    try:
+        with open(out / MANIFEST) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    # the compact scatter of CHSI_SCATTER_LOD is a different figure
+    code = code_hash() + ('lod' if app.SCATTER_LOD else '')
+
+    graphs = states(app)
+    jobs, hashes = {}, {}
+    for graph, combos in graphs.items():
+        for file, args in combos.values():
+            if file in hashes:
+                continue
+            hashes[file] = hashlib.sha1((code + graph + file).encode()).hexdigest()
+            if force or manifest.get(file) != hashes[file] \
+                    or not (out / 'figures' / file).exists():
+                jobs[file] = (graph, file, args, str(out))
+
+    start = time.perf_counter()
+    if jobs:
+        # forked workers inherit the imported app and its arrays
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with context.Pool(workers) as pool:
+            for file, _ in pool.imap_unordered(render, jobs.values(), chunksize=4):
+                manifest[file] = hashes[file]
+    manifest = {file: h for file, h in manifest.items() if file in hashes}
+    with open(out / MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    index = {graph: {key: file for key, (file, _) in combos.items()}
+             for graph, combos in graphs.items()}
+    write_shell(app, out, index)
+    return {'figures': len(hashes), 'rendered': len(jobs),
+            'skipped': len(hashes) - len(jobs),
+            'seconds': time.perf_counter() - start}
+
+
+SHELL = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>CHSI Dash</title>
+<link rel="stylesheet" href="assets/stylesheet.css">
+<script src="plotly.min.js"></script>
+<style>
+ .controls {{ font-size: 13px; margin-bottom: 1rem; }}
+ .controls > div {{ display: inline-block; margin-right: 40px; }}
+ .graph {{ width: 49%; display: inline-block; }}
+</style>
+</head>
+<body>
+<img src="assets/logo2.png" style="width: 30%">
+<div class="controls">
+ <div>Cause of Death<br>{cods}</div>
+ <div>Age Group<br>{ages}</div>
+ <div>{radio}<br>Slice Data by Poverty Level
+  <input id="slider1" type="range" min="0" max="30" step="1" value="0"></div>
+</div>
+<div id="choropleth" class="graph"></div>
+<div id="scatter3d" class="graph"></div>
+<p style="font-size: 10px">Source: U.S. Department of Health &amp; Human Services</p>
+<script>
+var INDEX = {index};
+function value(name) {{
+  var radio = document.querySelector('input[name="' + name + '"]:checked');
+  return radio ? radio.value : document.getElementById(name).value;
+}}
+function draw(graph, key) {{
+  var file = INDEX[graph][key];
+  if (!file) {{ return; }}
+  fetch('figures/' + file).then(function(r) {{ return r.json(); }})
+    .then(function(fig) {{ Plotly.react(graph, fig.data, fig.layout); }});
+}}
+function update() {{
+  draw('choropleth', [value('ages'), value('cods')].join(','));
+  draw('scatter3d', [value('ages'), value('radio1'), value('slider1')].join(','));
+}}
+document.querySelectorAll('select, input').forEach(function(el) {{
+  el.addEventListener(el.type === 'range' ? 'input' : 'change', update);
+}});
+update();
+</script>
+</body>
+</html>
+'''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('out', nargs='?', default='site')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='pool size, defaults to the number of cores')
+    parser.add_argument('--force', action='store_true',
+                        help='render every figure, even unchanged ones')
+    args = parser.parse_args(argv)
+    result = export(args.out, args.workers, args.force)
+    print('{figures} figures: {rendered} rendered, {skipped} unchanged, '
+          '{seconds:.1f} s'.format(**result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Memoized figure layer for the Dash callbacks.
+
+Both callbacks draw from a small, finite input grid, so the figures are built
+once per normalized input key and kept in a bounded LRU cache. Figures are
+stored as plain dicts and every caller gets its own deep copy, so nothing a
+caller does to the returned figure can leak back into the cache.
+
+The cache can also answer with a delta against the figure a client already
+shows (see `FigureCache.delta`), which assets/delta.js applies in the browser.
+"""
+from collections import OrderedDict
+import copy
+import threading
+import numpy as np
+
+
+def flatten(obj, prefix=''):
+    """Yields (dotted path, value) for every leaf of a nested trace dict."""
+    for key, value in obj.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            yield from flatten(value, path + '.')
+        else:
+            yield path, value
+
+
+def same(a, b) -> bool:
+    """Equality for figure leaves, comparing arrays and lists by content."""
+    if a is b:
+        return True
+    if isinstance(a, (list, tuple, np.ndarray)) or isinstance(b, (list, tuple, np.ndarray)):
+        a, b = np.asarray(a), np.asarray(b)
+        if a.shape != b.shape:
+            return False
+        if a.dtype.kind == 'f' and b.dtype.kind == 'f':
+            return bool(np.array_equal(a, b, equal_nan=True))
+        return bool(np.array_equal(a, b))
+    return bool(a == b)
+
+
+def figure_delta(base, fig):
+    """
+    Trace properties that differ between two figure dicts, as a list of
+    [trace index, dotted path, new value]. Returns None when the figures do
+    not share a skeleton (layout, trace count or trace structure differ),
+    in which case the whole figure has to be sent.
+    """
+    if len(base['data']) != len(fig['data']) or base['layout'] != fig['layout']:
+        return None
+    changes = []
+    for i, (old, new) in enumerate(zip(base['data'], fig['data'])):
+        old, new = dict(flatten(old)), dict(flatten(new))
+        if old.keys() != new.keys():
+            return None
+        changes.extend([i, path, value] for path, value in new.items()
+                       if not same(old[path], value))
+    return changes
+
+
+def apply_changes(fig, changes) -> dict:
+    """
+    Returns a copy of a figure dict with [trace index, dotted path, value]
+    changes applied, the format figure_delta produces. Only the dicts on a
+    changed path are copied; everything else is shared with `fig`. Mirrors
+    apply_delta in assets/delta.js.
+    """
+    data = list(fig['data'])
+    for i, path, value in changes:
+        keys = path.split('.')
+        obj = data[i] = dict(data[i])
+        for key in keys[:-1]:
+            obj[key] = dict(obj[key])
+            obj = obj[key]
+        obj[keys[-1]] = value
+    return {'data': data, 'layout': fig['layout']}
+
+
+class FigureCache():
+
+    def __init__(self, func, maxsize=128, key=None):
+        """
+        LRU cache in front of a figure builder.
+
+        Parameters
+        ----------
+        func : figure builder, returns a plotly Figure or a figure dict
+        maxsize : maximum number of cached figures, least recently used
+                  figures are evicted first
+        key : optional function mapping the builder's arguments to a hashable
+              key, used to fold inputs that give the same figure together
+        """
+        self.func = func
+        self.maxsize = maxsize
+        self.key = key if key is not None else (lambda *args: args)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        """Returns a private copy of the figure for `args`."""
+        return copy.deepcopy(self.get(*args))
+
+    def get(self, *args) -> dict:
+        """
+        Returns the cached figure dict for `args`, building it on a miss.
+        The returned dict is shared with the cache and must not be modified;
+        use calling the cache instead to get a private copy.
+        """
+        key = self.key(*args)
+        with self._lock:
+            fig = self._figures.get(key)
+            if fig is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return fig
+            self.misses += 1
+
+        # build outside the lock, a concurrent miss on the same key only
+        # costs one extra build
+        fig = self.func(*args)
+        fig = fig.to_dict() if hasattr(fig, 'to_dict') else fig
+
+        with self._lock:
+            self._figures[key] = fig
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+                self.evictions += 1
+        return fig
+
+    def delta(self, base, *args) -> dict:
+        """
+        Figure for `args` as an update to the figure the client already has.
+        `base` is the key of that figure, as returned under 'key' by the
+        previous call for the same client (None on the first call). Answers
+        with the whole figure when the skeleton changed, otherwise with only
+        the changed trace values.
+
+        Keys are sent to the client and later passed back in as builder
+        arguments, so with a custom `key` function every key must also be a
+        valid set of arguments for `func`. A `base` that is not such a key,
+        e.g. a stale or tampered client value, gets the whole figure.
+        """
+        key = self.key(*args)
+        fig = self.get(*args)
+        base_fig = self.base(base)
+        if base_fig is not None:
+            changes = figure_delta(base_fig, fig)
+            if changes is not None:
+                return {'key': key, 'changes': changes}
+        return {'key': key, 'figure': fig}
+
+    def base(self, base):
+        """The cached figure of a client supplied key, None if it is not a valid key."""
+        if not isinstance(base, (list, tuple)):
+            return None
+        try:
+            # keys are normalized already, anything else was not sent by us
+            if tuple(self.key(*base)) != tuple(base):
+                return None
+            return self.get(*base)
+        except (TypeError, ValueError, KeyError, IndexError):
+            return None
+
+    def warm(self, grid):
+        """Builds the figures for every argument tuple in `grid`."""
+        for args in grid:
+            self.get(*args)
+
+    def clear(self):
+        """Drops all cached figures. Counters are kept."""
+        with self._lock:
+            self._figures.clear()
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters plus the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._figures),
+                    'maxsize': self.maxsize}
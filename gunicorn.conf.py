@@ -0,0 +1,14 @@
+"""
+gunicorn settings of the Procfile, ``gunicorn app:server -c gunicorn.conf.py``.
+"""
+
+
+def post_worker_init(worker):
+    """
+    CHSI_FAST_STARTUP: starts the data loader in the worker once it has the
+    app, whether it imported app.py itself or was forked from a --preload
+    master, which never starts it (see the end of app.py).
+    """
+    import app
+    if app.FAST_STARTUP:
+        app.start_loading()
@@ -0,0 +1,100 @@
+"""Polling watcher for the CHSI source files.
+
+The app keeps everything it draws from in one snapshot (see `Snapshot` in
+app.py). When a watched csv changes, the watcher thread hands the changed
+files to a reload function, which builds and warms the next snapshot in the
+background and swaps it in, while requests already running finish on the
+old one. Workers keep serving throughout.
+
+Files are compared by size and mtime. A change is only reported once the
+file has stopped changing for one poll, so a csv that is still being
+written is never read.
+"""
+import logging
+import os
+import threading
+from data.cache import source_signature
+
+log = logging.getLogger(__name__)
+
+
+class Watcher():
+
+    def __init__(self, paths, callback, interval=2.0):
+        """
+        Calls `callback(changed paths)` from a background thread whenever
+        watched files changed.
+
+        Parameters
+        ----------
+        paths : files to watch
+        callback : reload function, errors are logged and the files are
+                   reported again on their next change
+        interval : seconds between polls
+        """
+        self.paths = [str(p) for p in paths]
+        self.callback = callback
+        self.interval = interval
+        self.reloads = 0
+        self.errors = 0
+        self._seen = {p: self.signature(p) for p in self.paths}
+        self._pending = {}
+        self._pid = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def signature(path):
+        """(size, mtime) of a file, None if it is missing."""
+        try:
+            sig = source_signature(path, with_hash=False)
+        except OSError:
+            return None
+        return sig['size'], sig['mtime_ns']
+
+    def poll(self) -> list:
+        """Files that changed and have been stable since the last poll."""
+        changed = []
+        for path in self.paths:
+            sig = self.signature(path)
+            if sig == self._seen[path]:
+                self._pending.pop(path, None)
+            elif self._pending.get(path) == sig and sig is not None:
+                changed.append(path)
+            else:
+                self._pending[path] = sig
+        return changed
+
+    def check(self) -> list:
+        """One poll, running the callback for stable changes."""
+        changed = self.poll()
+        if changed:
+            try:
+                self.callback(changed)
+                self.reloads += 1
+            except Exception:
+                self.errors += 1
+                log.exception('reloading %s failed, keeping the old data',
+                              ', '.join(changed))
+            for path in changed:
+                self._seen[path] = self._pending.pop(path)
+        return changed
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """
+        Starts the thread once per process. Threads do not survive a fork,
+        so forked (e.g. preloaded gunicorn) workers can simply call this
+        from a request hook and each gets its own watcher.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        threading.Thread(target=self.run, name='chsi-watcher', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
@@ -0,0 +1,261 @@
+"""Prometheus metrics for the Dash callbacks.
+
+Per callback output and input key, the Flask hooks installed by
+`Metrics.init_app` record
+  chsi_callback_compute_seconds   time spent inside the callback function
+  chsi_callback_serialize_seconds rest of the request: Dash's output
+                                  validation, JSON encoding and dispatch
+  chsi_callback_response_bytes    size of the response body before
+                                  content encoding
+  chsi_callback_requests_total    requests, by whether a response cache
+                                  answered them
+Keys outside the input grid registered with `Metrics.grid`, e.g. values
+clients made up, share the key label `other`, so the label set stays
+bounded. Registered caches report their hit, miss and size counters. Startup
+phases and dataset loads are timed with `Metrics.phase` / `Metrics.load`.
+Everything is served in the Prometheus text format at /metrics.
+
+Nothing but the startup timers runs unless the app calls `init_app` and
+wraps its callbacks with `timed`, which app.py only does with
+CHSI_METRICS=1.
+"""
+from collections import OrderedDict
+import bisect
+import contextlib
+import functools
+import threading
+import time
+import flask
+from responses import update_request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20,
+                 4 << 20)
+# key label of inputs outside the registered grid
+OTHER = 'other'
+
+
+def escape(value) -> str:
+    """Label value escaped for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_str(names, values) -> str:
+    """{name="value",...} for the given label names and values."""
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(n, escape(v))
+                          for n, v in zip(names, values)) + '}'
+
+
+class Histogram():
+
+    def __init__(self, name, doc, buckets, labels=()):
+        """
+        Cumulative histogram with one series per label value tuple.
+
+        Parameters
+        ----------
+        name : metric name
+        doc : HELP text
+        buckets : sorted upper bounds, +Inf is added
+        labels : label names
+        """
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Records one observation for the given label values."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per bucket counts, the last one is +Inf; then sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        """Text format lines of the histogram."""
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for values, counts in series:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, label_str(self.labels + ('le',), values + (bound,)),
+                    total))
+            labels = label_str(self.labels, values)
+            lines.append('{}_sum{} {!r}'.format(self.name, labels, counts[-1]))
+            lines.append('{}_count{} {}'.format(self.name, labels, total))
+        return lines
+
+
+class Metrics():
+
+    def __init__(self):
+        """
+        Registry of the app's metrics. Timing startup needs nothing else;
+        request metrics are only recorded once `init_app` installed the
+        hooks on the server.
+        """
+        self.keys = {}
+        self.grids = {}
+        self.compute = Histogram(
+            'chsi_callback_compute_seconds', 'Time spent in the callback function.',
+            LATENCY_BUCKETS, ('callback', 'key'))
+        self.serialize = Histogram(
+            'chsi_callback_serialize_seconds',
+            'Request time outside the callback: validation, JSON encoding, dispatch.',
+            LATENCY_BUCKETS, ('callback', 'key'))
+        self.size = Histogram(
+            'chsi_callback_response_bytes',
+            'Size of the callback response body, before content encoding.',
+            BYTES_BUCKETS, ('callback', 'key'))
+        self.requests = {}
+        self.phases = OrderedDict()
+        self.loads = OrderedDict()
+        self.caches = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times a startup phase."""
+        start = time.perf_counter()
+        yield
+        self.phases[name] = time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def load(self, name):
+        """Times loading a dataset."""
+        start = time.perf_counter()
+        yield
+        self.loads[name] = time.perf_counter() - start
+
+    def cache(self, name, cache):
+        """Reports the stats() counters of a FigureCache or ResponseCache."""
+        self.caches[name] = cache
+
+    def grid(self, output, grid):
+        """
+        Registers the input tuples of an output that get a key label of
+        their own, e.g. after a data reload; all others are labeled `other`.
+        """
+        key = self.keys.get(output) or (lambda *values: values)
+        self.grids[output] = frozenset(self.key_label(key(*args)) for args in grid)
+
+    @staticmethod
+    def key_label(key) -> str:
+        """('D', 1, 10) -> 'D,1,10'"""
+        return ','.join(str(k) for k in key)
+
+    def timed(self, func):
+        """Wraps a callback so its compute time is recorded per request."""
+        @functools.wraps(func)
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                flask.g.callback_seconds = time.perf_counter() - start
+        return wrapper
+
+    def init_app(self, server, keys=None):
+        """
+        Installs the request hooks and the /metrics route on a Flask server.
+        Install before any ResponseCache, so its hits are counted too.
+
+        Parameters
+        ----------
+        server : the Flask server of the Dash app
+        keys : {'<component id>.<property>': key function} mapping callback
+               input values to the key label, as for ResponseCache; None
+               labels with the raw input values. Until `grid` registers its
+               inputs, every key of an output is labeled `other`.
+        """
+        self.keys.update(keys or {})
+        server.before_request(self.before_request)
+        server.after_request(self.after_request)
+        server.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def before_request(self):
+        """Notes the start time and labels of callback requests."""
+        update = update_request()
+        if update is None:
+            return
+        output, values, _ = update
+        label = OTHER
+        try:
+            key = (self.keys.get(output) or (lambda *values: values))(*values)
+            if self.key_label(key) in self.grids.get(output, ()):
+                label = self.key_label(key)
+        except (TypeError, ValueError):
+            pass
+        flask.g.callback_labels = (output, label)
+        flask.g.callback_start = time.perf_counter()
+
+    def after_request(self, response):
+        """Records time and size of callback requests."""
+        labels = flask.g.pop('callback_labels', None)
+        if labels is None or response.status_code != 200:
+            return response
+        total = time.perf_counter() - flask.g.pop('callback_start')
+        compute = flask.g.pop('callback_seconds', None)
+        if compute is not None:
+            self.compute.observe(compute, *labels)
+        self.serialize.observe(total - (compute or 0.0), *labels)
+        # responses answered from a cache come gzip encoded, see responses.py
+        size = flask.g.pop('response_bytes', None)
+        if size is None:
+            size = response.calculate_content_length() or 0
+        self.size.observe(size, *labels)
+        cached = 'false' if compute is not None else 'true'
+        with self._lock:
+            key = (labels[0], cached)
+            self.requests[key] = self.requests.get(key, 0) + 1
+        return response
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        lines = []
+        for histogram in (self.compute, self.serialize, self.size):
+            lines.extend(histogram.render())
+
+        lines += ['# HELP chsi_callback_requests_total Callback requests answered.',
+                  '# TYPE chsi_callback_requests_total counter']
+        with self._lock:
+            requests = sorted(self.requests.items())
+        lines += ['chsi_callback_requests_total{} {}'.format(
+                  label_str(('callback', 'cached'), k), n) for k, n in requests]
+
+        stats = [(name, cache.stats()) for name, cache in self.caches.items()]
+        for field, kind, doc in (('hits', 'counter', 'Cache hits.'),
+                                 ('misses', 'counter', 'Cache misses.'),
+                                 ('evictions', 'counter', 'Cache evictions.'),
+                                 ('size', 'gauge', 'Entries in the cache.')):
+            name = 'chsi_cache_{}{}'.format(field, '_total' if kind == 'counter' else '')
+            lines += ['# HELP {} {}'.format(name, doc), '# TYPE {} {}'.format(name, kind)]
+            lines += ['{}{} {}'.format(name, label_str(('cache',), (cache,)), s[field])
+                      for cache, s in stats if field in s]
+
+        for name, values, label, doc in (
+                ('chsi_dataset_load_seconds', self.loads, 'dataset', 'Dataset load time.'),
+                ('chsi_startup_phase_seconds', self.phases, 'phase',
+                 'Duration of a startup phase.')):
+            lines += ['# HELP {} {}'.format(name, doc), '# TYPE {} gauge'.format(name)]
+            lines += ['{}{} {!r}'.format(name, label_str((label,), (k,)), v)
+                      for k, v in values.items()]
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        """The /metrics view."""
+        return flask.Response(self.render(), mimetype=None,
+                              content_type=CONTENT_TYPE)
@@ -0,0 +1,310 @@
+"""Precompute pipeline for the derived tables.
+
+The tables the app and the notebooks derive from the CHSI csv files are the
+nodes of a small DAG. Every node is a function of csv files and of the
+artifacts of other nodes, and its result is written as a pickle to
+``data/.artifacts/<node>/<key>.pkl``. The key is a sha1 over the node's
+code (its function and the modules it lists), the content of its csv
+files and the keys of its upstream nodes, so an artifact is stale exactly
+when something it was built from changed. Only stale nodes are built,
+nodes that do not depend on each other in parallel on a process pool.
+
+The app loads finished artifacts at startup (`load`) and computes whatever
+is missing or stale itself, so running the pipeline is optional.
+
+    python pipeline.py [build|status|clean] [node ...] [--workers N] [--force]
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import argparse
+import hashlib
+import inspect
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from data.scatter import SCATTER_AGES
+
+ROOT = Path(__file__).resolve().parent
+ARTIFACTS = ROOT / 'data' / '.artifacts'
+# bumped when the artifact file format changes
+FORMAT = 1
+CAUSES_OF_DEATH = 'data/LEADINGCAUSESOFDEATH.csv'
+DEMOGRAPHICS = 'data/DEMOGRAPHICS.csv'
+DATASET_CODE = ['data/dataset.py', 'data/cache.py']
+
+
+class Node():
+
+    def __init__(self, name, func, files=(), deps=(), code=()):
+        """
+        One derived table.
+
+        Parameters
+        ----------
+        name : artifact name
+        func : builds the artifact; called with the paths of `files`, then
+               the artifacts of `deps`, in that order
+        files : csv files it reads, relative to the repository root
+        deps : names of the nodes whose artifacts it takes
+        code : module files, relative to the repository root, that the
+               result depends on besides func itself
+        """
+        self.name = name
+        self.func = func
+        self.files = list(files)
+        self.deps = list(deps)
+        self.code = list(code)
+
+
+NODES = {}
+
+
+def node(name, files=(), deps=(), code=()):
+    """Registers the decorated function as the pipeline node `name`."""
+    def register(func):
+        NODES[name] = Node(name, func, files, deps, code)
+        return func
+    return register
+
+
+@node('state_means', files=[CAUSES_OF_DEATH], code=DATASET_CODE)
+def state_means(path):
+    """Mean of every cause column per state, CHSI_LEADINGCAUSESOFDEATH_MEAN.ipynb"""
+    from data.dataset import Dataset
+    return Dataset(path).state_means()
+
+
+@node('state_data', deps=['state_means'], code=['data/dataset.py'])
+def state_data(means):
+    """Age group/cause table of the state map, death_george_*.ipynb"""
+    from data.dataset import state_table
+    return state_table(means)
+
+
+@node('county_aggregates', files=[CAUSES_OF_DEATH],
+      code=DATASET_CODE + ['data/index.py', 'data/tensor.py'])
+def county_aggregates(path):
+    """county x age x cause Tensor of the means over all races."""
+    from data.dataset import Dataset
+    return Dataset(path).tensor.mean('race')
+
+
+@node('state_aggregates', deps=['county_aggregates'],
+      code=['data/dataset.py', 'data/tensor.py'])
+def state_aggregates(counties):
+    """state x age x cause Tensor, county_aggregates averaged per state."""
+    return counties.by_state()
+
+
+@node('national_correlations', files=[DEMOGRAPHICS, CAUSES_OF_DEATH],
+      code=DATASET_CODE + ['data/store.py', 'data/index.py', 'data/stats.py'])
+def national_correlations(demographics, causes_of_death):
+    """Pearson and Spearman matrices over all counties, see data/stats.py"""
+    from data.stats import Correlations
+    from data.store import DataStore
+    return Correlations(DataStore(Path(demographics).parent)).national()
+
+
+def scatter_node(age):
+    @node('scatter_arrays_' + age, files=[DEMOGRAPHICS],
+          code=DATASET_CODE + ['data/store.py', 'data/index.py', 'data/scatter.py'])
+    def scatter_arrays(path):
+        """3D scatter arrays of one age group, see data/scatter.py"""
+        from data.scatter import scatter_arrays
+        from data.store import DataStore
+        demogr = DataStore(Path(path).parent).domain('demographics')
+        return scatter_arrays(demogr, age)
+
+
+for age in SCATTER_AGES:
+    scatter_node(age)
+
+
+class Pipeline():
+
+    def __init__(self, root=ROOT, artifacts=ARTIFACTS):
+        """
+        Keys, artifacts and builds of the registered NODES.
+
+        Parameters
+        ----------
+        root : folder the node files and code paths are relative to
+        artifacts : folder the artifacts are written to
+        """
+        self.nodes = NODES
+        self.root = Path(root)
+        self.artifacts = Path(artifacts)
+        self._hashes = {}
+
+    def file_hash(self, path) -> str:
+        """sha1 of a file, remembered while its size and mtime stay the same."""
+        path = self.root / path
+        stat = os.stat(path)
+        sig = (str(path), stat.st_size, stat.st_mtime_ns)
+        if sig not in self._hashes:
+            self._hashes[sig] = hashlib.sha1(path.read_bytes()).hexdigest()
+        return self._hashes[sig]
+
+    def key(self, name, keys=None) -> str:
+        """Content hash of a node's code, files and upstream keys."""
+        keys = {} if keys is None else keys
+        if name not in keys:
+            node = self.nodes[name]
+            sha1 = hashlib.sha1('{}:{}'.format(FORMAT, name).encode())
+            sha1.update(inspect.getsource(node.func).encode())
+            for path in node.code + node.files:
+                sha1.update(path.encode())
+                sha1.update(self.file_hash(path).encode())
+            for dep in node.deps:
+                sha1.update(self.key(dep, keys).encode())
+            keys[name] = sha1.hexdigest()
+        return keys[name]
+
+    def path(self, name, key) -> Path:
+        return self.artifacts / name / '{}.pkl'.format(key[:16])
+
+    def upstream(self, names) -> list:
+        """The nodes and everything they depend on, dependencies first."""
+        order = []
+        def visit(name):
+            if name not in order:
+                for dep in self.nodes[name].deps:
+                    visit(dep)
+                order.append(name)
+        for name in names:
+            if name not in self.nodes:
+                raise KeyError('unknown pipeline node: {}'.format(name))
+            visit(name)
+        return order
+
+    def status(self, names=None) -> list:
+        """(name, key, fresh) of the nodes, dependencies first."""
+        keys = {}
+        return [(name, self.key(name, keys), self.path(name, self.key(name, keys)).exists())
+                for name in self.upstream(names or list(self.nodes))]
+
+    def load(self, name):
+        """The node's artifact if it is fresh, else None."""
+        path = self.path(name, self.key(name))
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def run(self, name, key) -> float:
+        """Builds one node from its files and upstream artifacts. Returns seconds."""
+        node = self.nodes[name]
+        start = time.perf_counter()
+        args = [str(self.root / path) for path in node.files]
+        for dep in node.deps:
+            with open(self.path(dep, self.key(dep)), 'rb') as f:
+                args.append(pickle.load(f))
+        result = node.func(*args)
+
+        path = self.path(name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name('.{}.{}'.format(path.name, os.getpid()))
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        # older versions of the node are stale for good
+        for old in path.parent.glob('*.pkl'):
+            if old != path:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+        return time.perf_counter() - start
+
+    def build(self, names=None, workers=None, force=False, log=None) -> dict:
+        """
+        Builds the stale nodes among `names` (all for None) and their
+        dependencies. A node is submitted to the pool as soon as all its
+        dependencies are done. Returns {name: seconds} of the built nodes.
+        """
+        status = self.status(names)
+        keys = {name: key for name, key, _ in status}
+        pending = {name for name, _, fresh in status if force or not fresh}
+        done = {name for name in keys if name not in pending}
+        built = {}
+        if not pending:
+            return built
+
+        # forked workers inherit the registered nodes, only names are sent
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            running = {}
+            while pending or running:
+                for name in sorted(pending):
+                    if all(dep in done for dep in self.nodes[name].deps):
+                        job = pool.submit(run, str(self.root), str(self.artifacts),
+                                          name, keys[name])
+                        running[job] = name
+                        pending.discard(name)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    built[name] = future.result()
+                    done.add(name)
+                    if log is not None:
+                        log('{:<24} {:8.1f} ms'.format(name, built[name] * 1e3))
+        return built
+
+    def clean(self) -> int:
+        """Removes every artifact that is not the current version of its node."""
+        current = {self.path(name, key) for name, key, _ in self.status()}
+        removed = 0
+        for path in self.artifacts.glob('*/*.pkl'):
+            if path not in current:
+                path.unlink()
+                removed += 1
+        return removed
+
+
+def run(root, artifacts, name, key) -> float:
+    """Pipeline.run in a pool worker."""
+    return Pipeline(root, artifacts).run(name, key)
+
+
+pipeline = Pipeline()
+
+
+def load(name):
+    """Fresh artifact of a registered node, None if it has to be computed."""
+    try:
+        return pipeline.load(name)
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', nargs='?', default='build',
+                        choices=['build', 'status', 'clean'])
+    parser.add_argument('nodes', nargs='*', help='defaults to all nodes')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='pool size, defaults to the number of cores')
+    parser.add_argument('--force', action='store_true',
+                        help='build every node, even fresh ones')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for name, key, fresh in pipeline.status(args.nodes):
+            print('{:<24} {}  {}'.format(name, key[:16], 'fresh' if fresh else 'stale'))
+    elif args.command == 'clean':
+        print('{} old artifacts removed'.format(pipeline.clean()))
+    else:
+        start = time.perf_counter()
+        built = pipeline.build(args.nodes, args.workers, args.force, log=print)
+        print('{} nodes built, {} fresh, {:.1f} s'.format(
+            len(built), len(pipeline.upstream(args.nodes or list(NODES))) - len(built),
+            time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""Pre-serialized Dash callback responses.
+
+A Dash figure callback is answered in three steps: the callback builds the
+figure, Dash validates the output and JSON encodes the whole response. For
+callbacks whose output depends on the inputs only, the encoded response
+body is the same every time for the same inputs, so this module keeps the
+bytes per normalized input key and answers repeat requests straight from a
+Flask `before_request` hook, skipping all three steps. The bytes are kept
+gzip compressed as well and sent that way to clients that accept it.
+
+`FigureBundle` serves the figures of a finite input grid as static,
+precompressed JSON blobs with content hash ETags, for browsers and CDNs.
+"""
+from collections import OrderedDict
+import gzip
+import hashlib
+import json
+import threading
+import flask
+import plotly
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UPDATE_ENDPOINT = '_dash-update-component'
+GZIP_LEVEL = 6
+
+
+def compressed_response(body, gzipped=None, **kwargs) -> flask.Response:
+    """
+    JSON response for the current request, gzip encoded when the client
+    accepts it and a compressed body is given.
+    """
+    response = flask.Response(mimetype='application/json', **kwargs)
+    response.vary.add('Accept-Encoding')
+    # the plain size, for metrics that compare with uncompressed responses
+    flask.g.response_bytes = len(body)
+    if gzipped is not None and 'gzip' in flask.request.accept_encodings:
+        response.set_data(gzipped)
+        response.content_encoding = 'gzip'
+    else:
+        response.set_data(body)
+    return response
+
+
+def update_request():
+    """
+    (output, input values, has state) of the current request if it is a Dash
+    callback update, else None.
+    """
+    request = flask.request
+    if request.method != 'POST' or not request.path.endswith(UPDATE_ENDPOINT):
+        return None
+    body = request.get_json(silent=True) or {}
+    values = [i.get('value') for i in body.get('inputs', [])]
+    return body.get('output'), values, bool(body.get('state'))
+
+
+class ResponseCache():
+
+    def __init__(self, server, outputs, maxsize=512):
+        """
+        LRU cache of encoded callback responses on a Dash app's Flask server.
+
+        Parameters
+        ----------
+        server : the Flask server of the Dash app
+        outputs : {'<component id>.<property>': key function} for the callback
+                  outputs to cache. The key function gets the callback input
+                  values and returns a hashable key; None uses the values.
+                  Only list outputs whose callback has no State.
+        maxsize : maximum number of cached responses
+        """
+        self.outputs = {out: key or (lambda *values: values)
+                        for out, key in outputs.items()}
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # bumped by clear(), responses of older generations are not stored
+        self.generation = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        server.before_request(self.lookup)
+        server.after_request(self.store)
+
+    def request_key(self):
+        """Cache key of the current request, None if it is not cacheable."""
+        update = update_request()
+        if update is None:
+            return None
+        output, values, state = update
+        if output not in self.outputs or state:
+            return None
+        try:
+            key = (output,) + tuple(self.outputs[output](*values))
+            # clients can post any JSON, e.g. a list for a dropdown value
+            hash(key)
+        except (TypeError, ValueError):
+            return None
+        return key
+
+    def lookup(self):
+        """before_request hook, answers cached requests."""
+        key = self.request_key()
+        if key is None:
+            return None
+        with self._lock:
+            body = self._responses.get(key)
+            if body is None:
+                self.misses += 1
+                flask.g.response_key = (key, self.generation)
+                return None
+            self._responses.move_to_end(key)
+            self.hits += 1
+        return compressed_response(*body)
+
+    def store(self, response):
+        """after_request hook, keeps the body of successful misses."""
+        key, generation = flask.g.pop('response_key', (None, None))
+        if key is not None and response.status_code == 200 \
+                and response.mimetype == 'application/json' \
+                and not response.content_encoding:
+            body = response.get_data()
+            body = (body, gzip.compress(body, GZIP_LEVEL))
+            with self._lock:
+                if generation != self.generation:
+                    return response
+                self._responses[key] = body
+                while len(self._responses) > self.maxsize:
+                    self._responses.popitem(last=False)
+        return response
+
+    def clear(self):
+        """
+        Drops all cached responses. Requests that started before are not
+        stored afterwards, so nothing computed from old data is kept.
+        """
+        with self._lock:
+            self._responses.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """Hit and miss counters plus the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._responses), 'maxsize': self.maxsize}
+
+
+class FigureBundle():
+
+    def __init__(self, server, figures, url='/figures'):
+        """
+        Every figure of a finite input grid as a static JSON blob, stored
+        gzip (and, if the brotli module is installed, brotli) compressed.
+
+          GET <url>/index.json     {name: {key: etag}} for the whole grid
+          GET <url>/<name>/<key>   one figure, e.g. /figures/scatter/D,1,10
+
+        Keys are the comma separated callback inputs of the grid. Inputs
+        that draw the same figure as earlier ones of the grid (see
+        FigureCache's `key`) are redirected to the first one's url, the one
+        index.json lists; anything else is a 404. Blobs carry a strong ETag
+        of their content hash and are answered with 304 when the client
+        already has them. Blobs are encoded on first request; see `build`.
+
+        Parameters
+        ----------
+        server : Flask server to add the routes to
+        figures : {name: (FigureCache, grid)}, grid being the list of
+                  argument tuples the bundle serves
+        url : url prefix of the routes
+        """
+        self.url = url
+        self._lock = threading.Lock()
+        self.update(figures)
+        server.add_url_rule(url + '/index.json', 'figure_index', self.index)
+        server.add_url_rule(url + '/<name>/<key>', 'figure_blob', self.serve)
+
+    def update(self, figures):
+        """Replaces the figures, e.g. after a data reload; drops all blobs."""
+        indexed = {}
+        for name, (cache, grid) in figures.items():
+            keys = OrderedDict()
+            for args in grid:
+                keys.setdefault(cache.key(*args), tuple(args))
+            indexed[name] = (cache, keys, {tuple(args) for args in grid})
+        with self._lock:
+            self.figures, self._blobs = indexed, {}
+
+    @staticmethod
+    def parse_key(key) -> tuple:
+        """'D,1,10' -> ('D', 1, 10)"""
+        return tuple(int(k) if k.lstrip('-').isdigit() else k
+                     for k in key.split(','))
+
+    def blob(self, name, args) -> dict:
+        """
+        Encoded blob of one figure: etag, gzip and br bytes. The plain JSON
+        is not kept, it is three times the gzip size and rarely asked for.
+        """
+        figures, blobs = self.figures, self._blobs
+        cache = figures[name][0]
+        key = (name, cache.key(*args))
+        blob = blobs.get(key)
+        if blob is None:
+            body = json.dumps(cache.get(*args), cls=plotly.utils.PlotlyJSONEncoder,
+                              separators=(',', ':')).encode()
+            blob = {'etag': hashlib.sha1(body).hexdigest(),
+                    'gzip': gzip.compress(body, 9)}
+            if brotli is not None:
+                blob['br'] = brotli.compress(body)
+            # a blob of replaced figures lands in the replaced dict only
+            blobs[key] = blob
+        return blob
+
+    def build(self):
+        """Encodes every blob of the grid ahead of time."""
+        for name, (_, keys, _) in self.figures.items():
+            for args in keys.values():
+                self.blob(name, args)
+
+    @staticmethod
+    def format_key(key) -> str:
+        """('D', 1, 10) -> 'D,1,10'"""
+        return ','.join(str(k) for k in key)
+
+    def index(self):
+        """The index.json view."""
+        return flask.jsonify({name: {self.format_key(args): self.blob(name, args)['etag']
+                                     for args in keys.values()}
+                              for name, (_, keys, _) in self.figures.items()})
+
+    def serve(self, name, key):
+        """The blob view, with conditional GET and content negotiation."""
+        if name not in self.figures:
+            flask.abort(404)
+        cache, keys, grid = self.figures[name]
+        args = self.parse_key(key)
+        if args not in grid:
+            flask.abort(404)
+        first = keys[cache.key(*args)]
+        if first != args:
+            # one url per figure, so clients and proxies cache it once
+            return flask.redirect('{}/{}/{}'.format(self.url, name, self.format_key(first)),
+                                  301)
+        blob = self.blob(name, args)
+
+        response = flask.Response(mimetype='application/json')
+        response.set_etag(blob['etag'])
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        if blob['etag'] in flask.request.if_none_match:
+            response.status_code = 304
+            return response
+        accepted = flask.request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in blob and encoding in accepted:
+                response.set_data(blob[encoding])
+                response.content_encoding = encoding
+                break
+        else:
+            response.set_data(gzip.decompress(blob['gzip']))
+        return response
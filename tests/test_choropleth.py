@@ -0,0 +1,57 @@
+"""
+The state choropleth is one trace, the first of the nine identical ones it
+used to draw, and stays small on the wire. Timings are left to
+``python -m benchmarks.choropleth``.
+"""
+import plotly.graph_objs as go
+import pytest
+from benchmarks.choropleth import encode
+
+MAX_BYTES = 16000
+SCL = [[0.0, 'rgb(242,240,247)'], [0.2, 'rgb(218,218,235)'],
+       [0.4, 'rgb(188,189,220)'], [0.6, 'rgb(158,154,200)'],
+       [0.8, 'rgb(117,107,177)'], [1.0, 'rgb(84,39,143)']]
+
+
+@pytest.fixture(scope='module')
+def app():
+    import app
+    return app
+
+
+def pairs(app):
+    return [col.split('_') for col in app.snapshot.choro.state_cod.columns[3:]]
+
+
+def trc1(hover, age, cause):
+    """Trace 0 of plot_state_choro before it was cut down to one trace."""
+    z, text = hover[age+'_'+cause]
+    return go.Choropleth(dict(
+        type='choropleth', autocolorscale=False, locations=hover['locations'],
+        z=z, locationmode='USA-states', hovertemplate='<b>%{text}</b>', text=text,
+        colorscale=SCL,
+        colorbar=dict(x=0.85, y=0.4, thickness=5, len=0.5, outlinewidth=0,
+                      title="Percentage"),
+        name=''))
+
+
+def test_one_trace(app):
+    hover = app.snapshot.choro.hover
+    for age, cause in pairs(app):
+        fig = app.plot_state_choro(hover, age, cause)
+        assert len(fig.data) == 1
+        assert encode(fig.data[0]) == encode(trc1(hover, age, cause))
+
+
+def test_payload_size(app):
+    hover = app.snapshot.choro.hover
+    for age, cause in pairs(app):
+        assert len(encode(app.plot_state_choro(hover, age, cause))) <= MAX_BYTES
+
+
+def test_callback_figure(app):
+    # the callback answers from the dict templates, which must encode the same
+    hover = app.snapshot.choro.hover
+    for age, cause in pairs(app):
+        assert encode(app.update_choro(age, cause)) == \
+            encode(app.plot_state_choro(hover, age, cause))
@@ -0,0 +1,22 @@
+"""Correlation matrices sliced from the national ones against computed ones."""
+import numpy as np
+import pytest
+from data.stats import Correlations, METHODS
+from data.store import DataStore
+
+
+@pytest.fixture(scope='module')
+def store():
+    return DataStore('./data')
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_seeded_slice(store, method):
+    seeded = Correlations(store)
+    seeded.seed(Correlations(store).national())
+    y = [col for col in seeded.y_columns if col.startswith('D_')]
+    sliced = seeded.matrix(method, y=y)
+    computed = Correlations(store).matrix(method, y=y)
+    assert list(sliced.columns) == y
+    np.testing.assert_allclose(sliced.to_numpy(), computed.to_numpy(), rtol=1e-12,
+                               atol=1e-15, equal_nan=True)
@@ -0,0 +1,44 @@
+"""Dataset.state_data against the original per state loop of George's notebook."""
+import numpy as np
+import pandas as pd
+import pytest
+from data.dataset import Dataset, changed_states
+
+pytest.importorskip('bottleneck')
+from benchmarks.state_data import state_data_loop
+
+CAUSES_OF_DEATH = './data/LEADINGCAUSESOFDEATH.csv'
+
+
+@pytest.fixture(scope='module')
+def cod():
+    return Dataset(CAUSES_OF_DEATH)
+
+
+def test_state_data_matches_loop(cod):
+    # sums run in a different order than the loop's, see state_data
+    pd.testing.assert_frame_equal(cod.state_data(), state_data_loop(cod.df),
+                                  check_exact=False, rtol=1e-12, atol=0)
+
+
+def test_state_data_states(cod):
+    full = cod.state_data()
+    states = ['Texas', 'Alaska', 'Wyoming']
+    part = cod.state_data(states)
+    expected = full[full['State_Name'].isin(states)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(part, expected, check_exact=False, rtol=1e-12, atol=0)
+
+
+def test_update_state_data(cod):
+    full = cod.state_data()
+    updated = cod.update_state_data(full, ['Texas'])
+    pd.testing.assert_frame_equal(updated, full, check_exact=False, rtol=1e-12, atol=0)
+    assert np.array_equal(updated['State_Name'], full['State_Name'])
+
+
+def test_changed_states_ignores_dtype(cod):
+    new = cod.df.copy()
+    new['A_Wh_Comp'] = new['A_Wh_Comp'].astype(np.float64)
+    assert changed_states(cod.df, new) == set()
+    new.loc[new['CHSI_State_Name'] == 'Texas', 'A_Wh_Comp'] += 1
+    assert changed_states(cod.df, new) == {'Texas'}